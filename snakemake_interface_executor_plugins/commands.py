@@ -0,0 +1,216 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+import asyncio
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Hashable,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
+
+from snakemake_interface_common.exceptions import WorkflowError
+
+Command = Union[str, Sequence[str]]
+
+
+class CommandError(WorkflowError):
+    """A command failed or timed out."""
+
+    def __init__(self, msg: str, returncode: Optional[int] = None, stderr: str = ""):
+        super().__init__(msg)
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def _format_command(cmd: Command) -> str:
+    return cmd if isinstance(cmd, str) else " ".join(cmd)
+
+
+class AsyncCommandRunner:
+    """Run external commands (e.g. squeue, sbatch, qstat) from within the
+    event loop of an executor without blocking it.
+
+    At most max_concurrent commands run at the same time. Read-only queries
+    (e.g. status queries) can be run with reuse_in_flight=True, such that an
+    identical query that is started while the same one is still running is
+    not run again; instead, all callers receive the result of the running one.
+    A string is run via the shell, a sequence of strings directly.
+
+    Example (in check_active_jobs)::
+
+        stdout = await self.command_runner.run(
+            ["squeue", "--me", "-h"], reuse_in_flight=True
+        )
+    """
+
+    # maximum length of a line read by iter_lines
+    max_line_length = 2**20
+
+    def __init__(self, max_concurrent: int = 10, timeout: Optional[float] = None):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: Dict[Hashable, asyncio.Future] = dict()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to a loop, hence create new ones
+        # if the runner is used from another loop
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrent))
+            self._loop = loop
+            self._in_flight = dict()
+        return self._semaphore
+
+    async def _spawn(
+        self, cmd: Command, env: Optional[Mapping[str, str]]
+    ) -> asyncio.subprocess.Process:
+        kwargs: Dict[str, Any] = dict(
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+            limit=self.max_line_length,
+        )
+        if isinstance(cmd, str):
+            return await asyncio.create_subprocess_shell(cmd, **kwargs)
+        return await asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+    async def _kill(self, proc: asyncio.subprocess.Process):
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    def _check_returncode(self, cmd: Command, returncode: int, stderr: str):
+        if returncode != 0:
+            raise CommandError(
+                f"Command {_format_command(cmd)} failed with exit code "
+                f"{returncode}: {stderr.strip()}",
+                returncode=returncode,
+                stderr=stderr,
+            )
+
+    def _timeout_error(self, cmd: Command, timeout: Optional[float]):
+        return CommandError(
+            f"Command {_format_command(cmd)} timed out after {timeout} seconds."
+        )
+
+    async def _run(
+        self,
+        cmd: Command,
+        timeout: Optional[float],
+        env: Optional[Mapping[str, str]],
+    ) -> str:
+        async with self._get_semaphore():
+            proc = await self._spawn(cmd, env)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                raise self._timeout_error(cmd, timeout)
+            finally:
+                await self._kill(proc)
+        # communicate() has waited for the process to exit
+        assert proc.returncode is not None
+        stderr_text = stderr.decode(errors="replace")
+        self._check_returncode(cmd, proc.returncode, stderr_text)
+        return stdout.decode(errors="replace")
+
+    async def run(
+        self,
+        cmd: Command,
+        timeout: Optional[float] = None,
+        env: Optional[Mapping[str, str]] = None,
+        reuse_in_flight: bool = False,
+    ) -> str:
+        """Run the given command and return its stdout.
+
+        Raises a CommandError if the command fails or does not finish within
+        timeout seconds (defaulting to self.timeout). With reuse_in_flight,
+        an identical command that is already running is awaited instead of
+        being run again. Only use this for commands without side effects
+        (e.g. status queries), never for e.g. submissions or cancellations.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        # resets the in-flight commands if called from another loop
+        self._get_semaphore()
+        if not reuse_in_flight:
+            return await self._run(cmd, timeout, env)
+
+        key = (
+            cmd if isinstance(cmd, str) else tuple(cmd),
+            None if env is None else tuple(sorted(env.items())),
+            timeout,
+        )
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(cmd, timeout, env))
+            in_flight = self._in_flight
+            self._in_flight[key] = task
+
+            def forget(_):
+                if in_flight.get(key) is task:
+                    del in_flight[key]
+
+            task.add_done_callback(forget)
+        # Shield the shared task, such that a cancelled caller does not cancel
+        # it for the others.
+        return await asyncio.shield(task)
+
+    async def iter_lines(
+        self,
+        cmd: Command,
+        timeout: Optional[float] = None,
+        env: Optional[Mapping[str, str]] = None,
+    ) -> AsyncIterator[str]:
+        """Run the given command and yield the lines of its stdout (without
+        line endings) while it is running.
+
+        This avoids holding large outputs (e.g. the status of all jobs of a
+        user) in memory. The timeout applies to the whole command. Raises a
+        CommandError after the last line if the command fails.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        async with self._get_semaphore():
+            proc = await self._spawn(cmd, env)
+            # both are pipes, see _spawn
+            assert proc.stdout is not None and proc.stderr is not None
+            # read stderr concurrently, such that the process does not block
+            # on a full stderr pipe
+            stderr_task = asyncio.ensure_future(proc.stderr.read())
+            try:
+                while True:
+                    remaining = None if deadline is None else deadline - loop.time()
+                    try:
+                        line = await asyncio.wait_for(proc.stdout.readline(), remaining)
+                    except asyncio.TimeoutError:
+                        raise self._timeout_error(cmd, timeout)
+                    if not line:
+                        break
+                    yield line.decode(errors="replace").rstrip("\r\n")
+                remaining = None if deadline is None else deadline - loop.time()
+                try:
+                    await asyncio.wait_for(proc.wait(), remaining)
+                    stderr = await asyncio.wait_for(stderr_task, remaining)
+                except asyncio.TimeoutError:
+                    raise self._timeout_error(cmd, timeout)
+            finally:
+                await self._kill(proc)
+                if not stderr_task.done():
+                    stderr_task.cancel()
+        # the process has exited, see proc.wait() above
+        assert proc.returncode is not None
+        self._check_returncode(cmd, proc.returncode, stderr.decode(errors="replace"))
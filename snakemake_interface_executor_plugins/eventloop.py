@@ -0,0 +1,147 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+from typing import Any, Callable, Coroutine, Optional
+
+# Environment variable that, if set, disables the use of uvloop.
+no_uvloop_envvar = "SNAKEMAKE_EXECUTOR_NO_UVLOOP"
+
+
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    if not os.environ.get(no_uvloop_envvar):
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class EventLoopService:
+    """An asyncio event loop running in a daemon thread, shared by all
+    executors of the process (see get_event_loop_service()).
+
+    Coroutines (e.g. status polling, log tailing, submissions) are scheduled
+    via spawn() or run() from any thread. An exception in one coroutine does
+    not affect the others or the loop. If uvloop is installed, it is used
+    (unless SNAKEMAKE_EXECUTOR_NO_UVLOOP is set).
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        # set by start()
+        assert self._loop is not None
+        return self._loop
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def start(self):
+        with self._lock:
+            if self.is_running():
+                return
+            loop = _new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                try:
+                    loop.run_forever()
+                finally:
+                    loop.close()
+
+            self._loop = loop
+            self._thread = threading.Thread(
+                target=run, name="snakemake-executor-loop", daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+
+    def stop(self):
+        """Stop the loop. Pending coroutines are cancelled."""
+        with self._lock:
+            if not self.is_running():
+                return
+
+            async def cancel_all():
+                current = asyncio.current_task()
+                tasks = [task for task in asyncio.all_tasks() if task is not current]
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                asyncio.get_running_loop().stop()
+
+            asyncio.run_coroutine_threadsafe(cancel_all(), self._loop)
+            self._thread.join()
+            self._thread = None
+            self._loop = None
+
+    def spawn(
+        self,
+        coro: Coroutine,
+        on_error: Optional[Callable[[BaseException], Any]] = None,
+    ) -> concurrent.futures.Future:
+        """Schedule the given coroutine on the loop and return a future for
+        its result.
+
+        If on_error is given, it is called (in the loop thread) with any
+        exception raised by the coroutine. Otherwise, the exception is only
+        stored in the returned future.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if on_error is not None:
+
+            def handle_error(future: concurrent.futures.Future):
+                if future.cancelled():
+                    return
+                e = future.exception()
+                if e is not None:
+                    try:
+                        on_error(e)
+                    except Exception as e:
+                        print(f"Error in error handler: {e}", file=sys.stderr)
+
+            future.add_done_callback(handle_error)
+        return future
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run the given coroutine on the loop and wait for its result.
+
+        Must not be called from the loop thread itself.
+        """
+        if self.in_loop_thread():
+            raise RuntimeError(
+                "bug: EventLoopService.run() called from within the event loop"
+            )
+        return self.spawn(coro).result(timeout)
+
+
+_service: Optional[EventLoopService] = None
+_service_lock = threading.Lock()
+
+
+def get_event_loop_service() -> EventLoopService:
+    """Return the event loop service shared by all executors."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EventLoopService()
+        return _service
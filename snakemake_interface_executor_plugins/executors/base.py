@@ -5,22 +5,98 @@ __license__ = "MIT"
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+import time
+from typing import Any, Dict, Hashable, Iterable, Iterator, KeysView, List, Optional
 
+from snakemake_interface_common.exceptions import WorkflowError
 from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
 from snakemake_interface_executor_plugins.logging import LoggerExecutorInterface
+from snakemake_interface_executor_plugins.metrics import ExecutorMetrics
+from snakemake_interface_executor_plugins.tracing import ExecutorTracer
 from snakemake_interface_executor_plugins.utils import format_cli_arg
 from snakemake_interface_executor_plugins.workflow import WorkflowExecutorInterface
 
 
-@dataclass
+@dataclass(slots=True)
 class SubmittedJobInfo:
     job: JobExecutorInterface
     external_jobid: Optional[str] = None
     aux: Optional[Dict[Any, Any]] = None
 
 
+class ActiveJobStore:
+    """Submitted jobs, indexed by their external jobid and their jobid.
+
+    Adding, removing and lookups are O(1). Iteration follows the order in
+    which jobs have been added. If several jobs share an external jobid (or
+    jobid), the lookup returns the one added last.
+    """
+
+    __slots__ = ("_jobs", "_by_external_jobid", "_by_jobid", "_list")
+
+    def __init__(self, job_infos: Iterable[SubmittedJobInfo] = ()):
+        self._jobs: Dict[int, SubmittedJobInfo] = dict()
+        self._by_external_jobid: Dict[str, SubmittedJobInfo] = dict()
+        self._by_jobid: Dict[int, SubmittedJobInfo] = dict()
+        self._list: Optional[List[SubmittedJobInfo]] = None
+        for job_info in job_infos:
+            self.add(job_info)
+
+    def add(self, job_info: SubmittedJobInfo):
+        self._jobs[id(job_info)] = job_info
+        if job_info.external_jobid is not None:
+            self._by_external_jobid[job_info.external_jobid] = job_info
+        self._by_jobid[job_info.job.jobid] = job_info
+        self._list = None
+
+    def discard(self, job_info: SubmittedJobInfo) -> bool:
+        """Remove the given job, returning False if it is not in the store."""
+        if self._jobs.pop(id(job_info), None) is None:
+            return False
+        external_jobid = job_info.external_jobid
+        if (
+            external_jobid is not None
+            and self._by_external_jobid.get(external_jobid) is job_info
+        ):
+            del self._by_external_jobid[external_jobid]
+        if self._by_jobid.get(job_info.job.jobid) is job_info:
+            del self._by_jobid[job_info.job.jobid]
+        self._list = None
+        return True
+
+    def get_by_external_jobid(self, external_jobid: str) -> Optional[SubmittedJobInfo]:
+        return self._by_external_jobid.get(external_jobid)
+
+    def get_by_jobid(self, jobid: int) -> Optional[SubmittedJobInfo]:
+        return self._by_jobid.get(jobid)
+
+    def external_jobids(self) -> KeysView[str]:
+        return self._by_external_jobid.keys()
+
+    def as_list(self) -> List[SubmittedJobInfo]:
+        """Return the jobs as a list.
+
+        The list is only rebuilt after the store has changed, hence it must
+        not be modified.
+        """
+        if self._list is None:
+            self._list = list(self._jobs.values())
+        return self._list
+
+    def __contains__(self, job_info: object) -> bool:
+        return id(job_info) in self._jobs
+
+    def __iter__(self) -> Iterator[SubmittedJobInfo]:
+        return iter(self.as_list())
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+
 class AbstractExecutor(ABC):
+    # maximum number of jobs passed to a single call of run_job_batch
+    max_job_batch_size = 1000
+
     def __init__(
         self,
         workflow: WorkflowExecutorInterface,
@@ -29,6 +105,8 @@ class AbstractExecutor(ABC):
         self.workflow = workflow
         self.dag = workflow.dag
         self.logger = logger
+        self.metrics = ExecutorMetrics()
+        self.tracer = ExecutorTracer()
 
     def get_resource_declarations_dict(self, job: JobExecutorInterface):
         def isdigit(i):
@@ -67,10 +145,86 @@ class AbstractExecutor(ABC):
         This method can be overwritten to submit many jobs in a more efficient
         way than one-by-one. Note that in any case, for each job, the callback
         functions have to be called individually!
+
+        Alternatively, executors that can submit many jobs at once (e.g. as an
+        array job) can implement get_job_batch_key and run_job_batch.
+        """
+        batches: Dict[Hashable, List[JobExecutorInterface]] = dict()
+        for job in jobs:
+            key = self._get_job_batch_key(job)
+            if key is None:
+                self.run_job_pre(job)
+                with self.tracer.job_span(job, "submit"):
+                    start = time.perf_counter()
+                    self.run_job(job)
+                    self.metrics.submit_seconds.observe(time.perf_counter() - start)
+            else:
+                batch = batches.setdefault(key, [])
+                batch.append(job)
+                if len(batch) >= self.max_job_batch_size:
+                    self._run_job_batch(batches.pop(key))
+        for batch in batches.values():
+            self._run_job_batch(batch)
+
+    def get_job_batch_key(self, job: JobExecutorInterface) -> Optional[Hashable]:
+        """Return a key for submitting the job together with other jobs.
+
+        Jobs with the same key are passed together to run_job_batch (at most
+        max_job_batch_size at a time). If None is returned (the default), the
+        job is submitted individually via run_job.
+        """
+        return None
+
+    @property
+    def supports_job_batches(self) -> bool:
+        """Whether the executor implements run_job_batch.
+
+        Only then are jobs submitted in batches according to
+        get_job_batch_key.
+        """
+        return type(self).run_job_batch is not AbstractExecutor.run_job_batch
+
+    def _get_job_batch_key(self, job: JobExecutorInterface) -> Optional[Hashable]:
+        if not self.supports_job_batches:
+            return None
+        return self.get_job_batch_key(job)
+
+    def run_job_batch(self, jobs: List[JobExecutorInterface]) -> List[SubmittedJobInfo]:
+        """Submit a batch of compatible jobs at once (e.g. as an array job).
+
+        Has to return one SubmittedJobInfo per job (in any order). In contrast
+        to run_job, report_job_submission must not be called here, this is
+        done for each returned SubmittedJobInfo automatically.
+
+        The default implementation submits the jobs one by one via run_job,
+        which reports the submissions itself, and therefore returns an empty
+        list. It is not used by run_jobs, which submits jobs in batches only
+        if this method is overwritten (see supports_job_batches).
         """
         for job in jobs:
-            self.run_job_pre(job)
             self.run_job(job)
+        return []
+
+    def _run_job_batch(self, jobs: List[JobExecutorInterface]):
+        for job in jobs:
+            self.run_job_pre(job)
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        job_infos = self.run_job_batch(jobs)
+        self.metrics.submit_seconds.observe(time.perf_counter() - start)
+        for job in jobs:
+            self.tracer.add_job_span(job, "submit", start_ns, batch_size=len(jobs))
+        job_infos_by_job = {id(job_info.job): job_info for job_info in job_infos}
+        if len(job_infos) != len(jobs) or any(
+            id(job) not in job_infos_by_job for job in jobs
+        ):
+            raise WorkflowError(
+                "Executor has to return exactly one submitted job per job of a "
+                f"batch, but returned {len(job_infos)} submitted jobs for a batch "
+                f"of {len(jobs)} jobs."
+            )
+        for job in jobs:
+            self.report_job_submission(job_infos_by_job[id(job)])
 
     @abstractmethod
     def run_job(
@@ -87,13 +241,16 @@ class AbstractExecutor(ABC):
         self.printjob(job)
 
     def report_job_success(self, job_info: SubmittedJobInfo):
+        self.metrics.successes.inc(rule=job_info.job.name)
         self.workflow.scheduler.finish_callback(job_info.job)
 
     def report_job_error(self, job_info: SubmittedJobInfo, msg=None, **kwargs):
+        self.metrics.errors.inc(rule=job_info.job.name)
         self.print_job_error(job_info, msg, **kwargs)
         self.workflow.scheduler.error_callback(job_info.job)
 
     def report_job_submission(self, job_info: SubmittedJobInfo):
+        self.metrics.submissions.inc(rule=job_info.job.name)
         self.workflow.scheduler.submit_callback(job_info.job)
 
     @abstractmethod
@@ -0,0 +1,226 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
+from snakemake_interface_executor_plugins.utils import TargetSpec
+
+
+def _unique(items: Iterable[Any]) -> List[Any]:
+    return list(dict.fromkeys(items))
+
+
+def _get_runtime(job: JobExecutorInterface) -> Optional[float]:
+    runtime = job.resources.get("runtime")
+    if isinstance(runtime, bool) or not isinstance(runtime, (int, float)):
+        return None
+    return runtime
+
+
+class JobBundle(JobExecutorInterface):
+    """Several jobs with equal resources that are submitted as a single remote
+    job.
+
+    The remote job runs the bundled jobs one after another (see
+    RemoteExecutor.format_bundle_exec). The bundle is identified by the jobid
+    of its first job. Unlike the jobs of the workflow, it has no rule
+    attribute, the bundled jobs can be obtained by iterating over it.
+    """
+
+    def __init__(self, jobs: Sequence[JobExecutorInterface]):
+        assert jobs, "bug: empty job bundle"
+        self.jobs = list(jobs)
+        self._first = self.jobs[0]
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def __iter__(self):
+        return iter(self.jobs)
+
+    def __repr__(self) -> str:
+        return f"JobBundle({[job.jobid for job in self.jobs]})"
+
+    @property
+    def name(self) -> str:
+        return self._first.name
+
+    @property
+    def jobid(self) -> int:
+        return self._first.jobid
+
+    def logfile_suggestion(self, prefix: str) -> str:
+        return self._first.logfile_suggestion(prefix)
+
+    def is_group(self) -> bool:
+        return False
+
+    def log_info(self, skip_dynamic: bool = False) -> None:
+        for job in self.jobs:
+            job.log_info(skip_dynamic=skip_dynamic)
+
+    def log_error(self, msg: Optional[str] = None, **kwargs) -> None:
+        for job in self.jobs:
+            job.log_error(msg, **kwargs)
+
+    def properties(
+        self, omit_resources: Sequence[str] = ("_cores", "_nodes"), **aux_properties
+    ) -> Mapping[str, Any]:
+        return {
+            "type": "bundle",
+            "jobid": self.jobid,
+            "jobids": [job.jobid for job in self.jobs],
+            "rules": self.rules,
+            "threads": self.threads,
+            "resources": {
+                name: value
+                for name, value in self.resources.items()
+                if name not in omit_resources
+            },
+            **aux_properties,
+        }
+
+    @property
+    def resources(self) -> Mapping[str, Any]:
+        # The bundled jobs have equal resources, except for the runtime, which
+        # adds up since the jobs may run one after another.
+        resources: Dict[str, Any] = dict(self._first.resources)
+        if _get_runtime(self._first) is not None:
+            resources["runtime"] = sum(_get_runtime(job) or 0 for job in self.jobs)
+        return resources
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+    @property
+    def is_updated(self) -> bool:
+        return any(job.is_updated for job in self.jobs)
+
+    @property
+    def output(self) -> List[str]:
+        return [f for job in self.jobs for f in job.output]
+
+    def register(self, external_jobid: Optional[str] = None) -> None:
+        for job in self.jobs:
+            job.register(external_jobid=external_jobid)
+
+    # Snakemake's jobs return a list of target specs here and provide rules as
+    # a property listing rule names, unlike the annotations of the interface.
+    # The bundle has to behave like them, because it is passed to the same
+    # code (e.g. RealExecutor.get_job_args).
+    def get_target_spec(self) -> List[TargetSpec]:  # type: ignore[override]
+        return [
+            spec
+            for job in self.jobs
+            for spec in cast(List[TargetSpec], job.get_target_spec())
+        ]
+
+    @property
+    def rules(self) -> List[str]:  # type: ignore[override]
+        return _unique(
+            rule for job in self.jobs for rule in cast(Iterable[str], job.rules)
+        )
+
+    @property
+    def attempt(self) -> int:
+        return self._first.attempt
+
+    @property
+    def input(self) -> List[str]:
+        return _unique(f for job in self.jobs for f in job.input)
+
+    @property
+    def threads(self) -> int:
+        return self._first.threads
+
+    @property
+    def log(self) -> List[str]:
+        return [f for job in self.jobs for f in job.log]
+
+    def get_wait_for_files(self) -> List[str]:
+        return _unique(f for job in self.jobs for f in job.get_wait_for_files())
+
+    def format_wildcards(self, string, **variables) -> str:
+        return self._first.format_wildcards(string, **variables)
+
+    @property
+    def is_containerized(self) -> bool:
+        return any(job.is_containerized for job in self.jobs)
+
+
+def get_job_bundle_key(
+    job: JobExecutorInterface, max_runtime: float
+) -> Optional[Hashable]:
+    """Return a key that is equal for jobs that can be bundled together, or
+    None if the job cannot be bundled.
+
+    Only small jobs are bundled, i.e. jobs with a numeric runtime resource of
+    at most max_runtime (in minutes).
+    """
+    if job.is_group() or job.is_local:
+        return None
+    runtime = _get_runtime(job)
+    if runtime is None or runtime > max_runtime:
+        return None
+    resources: Dict[str, Any] = dict(job.resources)
+    # the runtime of a bundle is the sum of the runtimes of its jobs
+    resources.pop("runtime", None)
+    try:
+        return (job.attempt, job.threads, frozenset(resources.items()))
+    except TypeError:
+        # unhashable resource values
+        return None
+
+
+def bundle_jobs(
+    jobs: Iterable[JobExecutorInterface], max_bundle_size: int, max_runtime: float
+) -> List[JobExecutorInterface]:
+    """Combine jobs with equal bundle keys into bundles of at most
+    max_bundle_size jobs, whose runtimes add up to at most max_runtime (in
+    minutes).
+
+    Jobs that cannot be bundled, or that would form a bundle of one, are
+    returned as they are. The order of the first job of each bundle is
+    preserved.
+    """
+    # bundle key -> jobs and summed runtime of the open bundle
+    groups: Dict[Hashable, Tuple[List[JobExecutorInterface], float]] = dict()
+    result: List[Any] = []
+    for job in jobs:
+        key = get_job_bundle_key(job, max_runtime)
+        if key is None:
+            result.append(job)
+            continue
+        runtime = _get_runtime(job) or 0
+        group, group_runtime = groups.get(key, (None, 0))
+        if (
+            group is None
+            or len(group) >= max_bundle_size
+            or group_runtime + runtime > max_runtime
+        ):
+            group, group_runtime = [], 0
+            # placeholder, replaced by the bundle below
+            result.append(group)
+        group.append(job)
+        groups[key] = (group, group_runtime + runtime)
+    return [
+        (item[0] if len(item) == 1 else JobBundle(item))
+        if isinstance(item, list)
+        else item
+        for item in result
+    ]
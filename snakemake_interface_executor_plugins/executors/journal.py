@@ -0,0 +1,165 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import IO, Any, Dict, List, Optional, cast
+
+from snakemake_interface_common.exceptions import WorkflowError
+from snakemake_interface_executor_plugins.executors.base import SubmittedJobInfo
+from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
+from snakemake_interface_executor_plugins.utils import TargetSpec
+
+
+def job_output_digest(job: JobExecutorInterface) -> str:
+    """Return a digest of the rule names, wildcards and output files of the
+    given job.
+
+    Unlike the jobid, these identify a job across runs. Only jobs without
+    output files are told apart by their jobid as well.
+    """
+    output = sorted(map(str, job.output))
+    targets = sorted(
+        (
+            spec.rulename,
+            sorted((str(k), str(v)) for k, v in spec.wildcards_dict.items()),
+        )
+        for spec in cast(List[TargetSpec], job.get_target_spec())
+    )
+    content = json.dumps(
+        [targets, output, None if output else job.jobid], sort_keys=True
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class SubmissionJournal:
+    """Append-only journal of submitted and finished jobs.
+
+    Each line is a JSON record with the event ("submitted" or "finished"),
+    the external jobid and the output digest of the job (see
+    job_output_digest). Upon opening, the jobs that have been submitted but
+    not finished in previous runs are loaded, and the journal is compacted to
+    these jobs. The journal is kept open until close() is called, such that
+    recording a job does not open and close the file (which is slow on
+    network filesystems).
+    """
+
+    # records older than this (in seconds) are dropped when opening the journal
+    max_record_age = 7 * 24 * 3600
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # output digest -> record of jobs that were running at the last exit
+        self.running: Dict[str, Dict[str, Any]] = self._load()
+        self._file: Optional[IO[str]] = self._compact()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        running: Dict[str, Dict[str, Any]] = dict()
+        min_time = time.time() - self.max_record_age
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # incomplete last line after a crash
+                        continue
+                    if record["time"] < min_time:
+                        continue
+                    if record["event"] == "submitted":
+                        running[record["output_digest"]] = record
+                    elif record["event"] == "finished":
+                        submitted = running.get(record["output_digest"])
+                        if (
+                            submitted is not None
+                            and submitted["external_jobid"] == record["external_jobid"]
+                        ):
+                            del running[record["output_digest"]]
+        except FileNotFoundError:
+            pass
+        return running
+
+    def _compact(self) -> IO[str]:
+        """Rewrite the journal with the running jobs only and return it,
+        opened for appending.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            for record in self.running.values():
+                print(json.dumps(record), file=f)
+        os.replace(tmp, self.path)
+        # line buffered, such that each record is written out immediately and
+        # survives a crash
+        return open(self.path, "a", buffering=1)
+
+    def _append(self, record: Dict[str, Any]):
+        self._append_line(json.dumps(record))
+
+    def _append_line(self, line: str):
+        with self._lock:
+            if self._file is None:
+                return
+            print(line, file=self._file)
+
+    def pop_running(
+        self, job: JobExecutorInterface, external_jobid: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Remove and return the record of the given job if it was still
+        running at the end of a previous run.
+
+        If an external jobid is given (e.g. from the incomplete marker of the
+        job), the record has to refer to the same external job.
+        """
+        digest = job_output_digest(job)
+        record = self.running.get(digest)
+        if record is None or (
+            external_jobid is not None and record["external_jobid"] != external_jobid
+        ):
+            return None
+        del self.running[digest]
+        return record
+
+    def submitted(self, job_info: SubmittedJobInfo):
+        record = {
+            "event": "submitted",
+            "time": time.time(),
+            "rule": job_info.job.name,
+            "output_digest": job_output_digest(job_info.job),
+            "external_jobid": job_info.external_jobid,
+            "aux": job_info.aux,
+        }
+        try:
+            line = json.dumps(record)
+        except (TypeError, ValueError) as e:
+            # otherwise, the job could not be checked after reattaching it
+            raise WorkflowError(
+                "The submission journal requires the aux information of "
+                f"submitted jobs to be JSON serializable: {e}. Either disable "
+                "the submission_journal common setting or pass JSON "
+                "serializable aux information to SubmittedJobInfo."
+            )
+        self._append_line(line)
+
+    def finished(self, job_info: SubmittedJobInfo, success: bool):
+        self._append(
+            {
+                "event": "finished",
+                "time": time.time(),
+                "output_digest": job_output_digest(job_info.job),
+                "external_jobid": job_info.external_jobid,
+                "success": success,
+            }
+        )
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -4,7 +4,12 @@ __email__ = "johannes.koester@uni-due.de"
 __license__ = "MIT"
 
 from abc import abstractmethod
-from typing import Dict
+from dataclasses import dataclass
+import hashlib
+import os
+import secrets
+import shlex
+from typing import Dict, Optional, Tuple
 
 from snakemake_interface_common import at_least_snakemake_version
 from snakemake_interface_executor_plugins.executors.base import (
@@ -22,6 +27,17 @@ from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
 from snakemake_interface_executor_plugins.workflow import WorkflowExecutorInterface
 
 
+@dataclass(frozen=True)
+class JobExecContext:
+    """Parts of the job command that are the same for all jobs of a run."""
+
+    # everything before the job specific args (envvars, precommand, python,
+    # snakefile)
+    head: str
+    # everything after the job specific args (general args, mode, groupid)
+    tail: str
+
+
 class RealExecutor(AbstractExecutor):
     def __init__(
         self,
@@ -35,6 +51,9 @@ class RealExecutor(AbstractExecutor):
         )
         self.executor_settings = self.workflow.executor_settings
         self.snakefile = workflow.main_snakefile
+        self._job_exec_context: Optional[JobExecContext] = None
+        # (prefix, content digest) -> path of the written file
+        self._written_aux_files: Dict[Tuple[str, str], str] = dict()
         if post_init:
             self.__post_init__()
 
@@ -131,6 +150,17 @@ class RealExecutor(AbstractExecutor):
         declaration = ""
         envars = self.envvars()
         if self.common_settings.pass_envvar_declarations_to_cmd and envars:
+            if self.common_settings.envvar_declarations_file:
+                dirname = self.get_aux_file_dir()
+                if dirname is not None:
+                    content = "".join(
+                        f"export {var}={shlex.quote(str(value))}\n"
+                        for var, value in envars.items()
+                    )
+                    path = self.write_aux_file(
+                        dirname, "envvars", content, private=True
+                    )
+                    return f". {shlex.quote(path)} &&"
             defs = " ".join(f"{var}={value!r}" for var, value in envars.items())
             declaration = f"export {defs} &&"
         return declaration
@@ -141,6 +171,106 @@ class RealExecutor(AbstractExecutor):
     def get_job_exec_suffix(self, job: JobExecutorInterface):
         return ""
 
+    def get_job_exec_context(self) -> JobExecContext:
+        """Return the job independent parts of the job command.
+
+        They are computed once and cached until invalidate_job_exec_context()
+        is called.
+        """
+        if self._job_exec_context is None:
+            general_args = self.workflow.spawned_job_args_factory.general_args(
+                executor_common_settings=self.common_settings
+            )
+            precommand = self.workflow.spawned_job_args_factory.precommand(
+                executor_common_settings=self.common_settings
+            )
+            if precommand:
+                precommand += " &&"
+
+            self._job_exec_context = JobExecContext(
+                head=join_cli_args(
+                    [
+                        self.get_envvar_declarations(),
+                        precommand,
+                        self.get_python_executable(),
+                        "-m snakemake",
+                        format_cli_arg("--snakefile", self.get_snakefile()),
+                    ]
+                ),
+                tail=join_cli_args(
+                    [
+                        general_args,
+                        self.additional_general_args(),
+                        format_cli_arg("--mode", self.get_exec_mode().item_to_choice()),
+                        format_cli_arg(
+                            "--local-groupid",
+                            self.workflow.group_settings.local_groupid,
+                            skip=self.job_specific_local_groupid,
+                        ),
+                    ]
+                ),
+            )
+        return self._job_exec_context
+
+    def invalidate_job_exec_context(self):
+        """Invalidate the cached job independent parts of the job command.
+
+        This has to be called if any setting that they depend on (e.g. the
+        envvars or the general args) changes during the run.
+        """
+        self._job_exec_context = None
+
+    def get_aux_file_dir(self) -> Optional[str]:
+        """Return a directory for auxiliary files that is accessible from the
+        spawned jobs, or None if there is no such directory (the default).
+        """
+        return None
+
+    def write_aux_file(
+        self, dirname: str, prefix: str, content: str, private: bool = False
+    ) -> str:
+        """Write content to a file in the given directory and return its path.
+
+        The file is named by the hash of its content, such that jobs needing
+        the same content share the same file, which is written only once.
+        If private is set, the file is only readable and writable by the user.
+        It is then named by a random token instead, since its name must not
+        allow to test guesses of its content. It is written once per run.
+        """
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        path = self._written_aux_files.get((prefix, digest))
+        if path is None:
+            name = secrets.token_hex(16) if private else digest
+            path = os.path.join(dirname, f"{prefix}.{name}")
+            if not os.path.exists(path):
+                # write atomically, a job might already read the file
+                tmp = f"{path}.{os.getpid()}.tmp"
+                mode = 0o600 if private else 0o666
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+                with os.fdopen(fd, "w") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+            self._written_aux_files[(prefix, digest)] = path
+        return path
+
+    def _spill_job_args(self, job_args: str):
+        """Move too large job specific args into a file.
+
+        Returns a command that sources the file (or an empty string) and the
+        args to use in the job command.
+        """
+        max_size = self.common_settings.max_inline_job_args_size
+        if max_size is None or len(job_args.encode()) <= max_size:
+            return "", job_args
+        dirname = self.get_aux_file_dir()
+        if dirname is None:
+            return "", job_args
+        # The file sets the positional parameters of the shell that executes
+        # the job command. The args are thereby parsed by the same shell and
+        # in the same way as if they were part of the job command.
+        path = self.write_aux_file(dirname, "jobargs", f"set -- {job_args}\n")
+        return f". {shlex.quote(path)} &&", '"$@"'
+
     def format_job_exec(self, job: JobExecutorInterface) -> str:
         prefix = self.get_job_exec_prefix(job)
         if prefix:
@@ -148,32 +278,16 @@ class RealExecutor(AbstractExecutor):
         suffix = self.get_job_exec_suffix(job)
         if suffix:
             suffix = f"&& {suffix}"
-        general_args = self.workflow.spawned_job_args_factory.general_args(
-            executor_common_settings=self.common_settings
-        )
-        precommand = self.workflow.spawned_job_args_factory.precommand(
-            executor_common_settings=self.common_settings
-        )
-        if precommand:
-            precommand += " &&"
+        context = self.get_job_exec_context()
+        source_job_args, job_args = self._spill_job_args(self.get_job_args(job))
 
         args = join_cli_args(
             [
                 prefix,
-                self.get_envvar_declarations(),
-                precommand,
-                self.get_python_executable(),
-                "-m snakemake",
-                format_cli_arg("--snakefile", self.get_snakefile()),
-                self.get_job_args(job),
-                general_args,
-                self.additional_general_args(),
-                format_cli_arg("--mode", self.get_exec_mode().item_to_choice()),
-                format_cli_arg(
-                    "--local-groupid",
-                    self.workflow.group_settings.local_groupid,
-                    skip=self.job_specific_local_groupid,
-                ),
+                source_job_args,
+                context.head,
+                job_args,
+                context.tail,
                 suffix,
             ]
         )
@@ -5,25 +5,119 @@ __license__ = "MIT"
 
 from abc import ABC, abstractmethod
 import asyncio
+from collections import deque
+import concurrent.futures
+import contextvars
+import time
 from fractions import Fraction
+import inspect
 import os
+import queue
+import shlex
 import shutil
 import stat
 import sys
 import tempfile
 import threading
-from typing import Generator, List
+from typing import (
+    AsyncIterator,
+    Deque,
+    Dict,
+    Generator,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
 from snakemake_interface_common.exceptions import WorkflowError
-from snakemake_interface_executor_plugins.executors.base import SubmittedJobInfo
+from snakemake_interface_executor_plugins.commands import (
+    AsyncCommandRunner,
+    CommandError,
+)
+from snakemake_interface_executor_plugins.eventloop import get_event_loop_service
+from snakemake_interface_executor_plugins.executors.base import (
+    ActiveJobStore,
+    SubmittedJobInfo,
+)
+from snakemake_interface_executor_plugins.executors.bundle import (
+    JobBundle,
+    bundle_jobs,
+)
+from snakemake_interface_executor_plugins.executors.journal import SubmissionJournal
 from snakemake_interface_executor_plugins.executors.real import RealExecutor
+from snakemake_interface_executor_plugins.executors.sources import (
+    SourceArchive,
+    build_source_archive,
+)
 from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
 from snakemake_interface_executor_plugins.logging import LoggerExecutorInterface
+from snakemake_interface_executor_plugins.metrics import ExecutorMetrics
 from snakemake_interface_executor_plugins.settings import ExecMode, SharedFSUsage
-from snakemake_interface_executor_plugins.utils import async_lock, format_cli_arg
+from snakemake_interface_executor_plugins.tracing import status_checks_track
+from snakemake_interface_executor_plugins.utils import (
+    CompiledTemplate,
+    format_cli_arg,
+)
 from snakemake_interface_executor_plugins.workflow import WorkflowExecutorInterface
 
 from throttler import Throttler
 
+# job id -> submissions (job info and register_job) reported by an async run_job
+_AsyncSubmissions = Dict[int, List[Tuple[SubmittedJobInfo, bool]]]
+# Submissions of the current call of RemoteExecutor._run_jobs_async. Set in the
+# context of the tasks running run_job only.
+_async_submissions: "contextvars.ContextVar[Optional[_AsyncSubmissions]]" = (
+    contextvars.ContextVar("async_submissions", default=None)
+)
+
+
+class _TimedThrottler(Throttler):
+    """Throttler that records the time spent waiting for it."""
+
+    __slots__ = ("_metrics",)
+
+    def __init__(self, metrics: ExecutorMetrics, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics = metrics
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await super().__aenter__()
+        self._metrics.throttle_wait_seconds.observe(time.perf_counter() - start)
+
+
+class _JobPollState:
+    """When an active job has last changed its state and has last been checked."""
+
+    __slots__ = ("changed", "checked", "status")
+
+    def __init__(self, now: float):
+        self.changed = now
+        self.checked = now
+        self.status: Optional[Hashable] = None
+
+
+class _StatusCheckThread:
+    """Thread-like view of the status checks of a remote executor.
+
+    The status checks used to run in a thread of their own
+    (RemoteExecutor.wait_thread). They now run on the shared event loop.
+    This keeps is_alive() and join() working for plugins that use them.
+    """
+
+    daemon = True
+
+    def __init__(self, future: concurrent.futures.Future):
+        self._future = future
+
+    def is_alive(self) -> bool:
+        return not self._future.done()
+
+    def join(self, timeout: Optional[float] = None):
+        concurrent.futures.wait([self._future], timeout=timeout)
+
 
 class RemoteExecutor(RealExecutor, ABC):
     """Backend for distributed execution.
@@ -37,6 +131,23 @@ class RemoteExecutor(RealExecutor, ABC):
     """
 
     default_jobscript = "jobscript.sh"
+    job_exit_notification_check_seconds = 0.5
+    status_check_backoff_factor = 1.5
+    metrics_export_seconds = 15
+    max_concurrent_commands = 10
+    max_consecutive_status_check_errors = 10
+    # Status check errors that are retried (up to
+    # max_consecutive_status_check_errors times in a row), e.g. an unavailable
+    # scheduler API or a failing status command. Other errors are passed to
+    # the scheduler right away.
+    transient_status_check_errors = (OSError, CommandError)
+    # with max_status_check_staleness, jobs are checked again after this
+    # fraction of the time since their last state change
+    status_check_age_factor = 0.1
+    # number of source archives kept in the cache (see get_source_archive)
+    max_cached_source_archives = 3
+    # time to wait for the event loop to collect the active jobs in cancel()
+    cancel_snapshot_timeout = 10
 
     def __init__(
         self,
@@ -49,6 +160,11 @@ class RemoteExecutor(RealExecutor, ABC):
             post_init=False,  # we call __post_init__ ourselves
         )
         self._next_seconds_between_status_checks = None
+        self._adaptive_seconds_between_status_checks = None
+        # number of submitted and finished jobs since the last status check
+        self._n_job_state_changes = 0
+        self._reporting_notified_jobs = False
+        self._last_metrics_export = 0.0
         self.max_status_checks_per_second = (
             self.workflow.remote_execution_settings.max_status_checks_per_second
         )
@@ -68,6 +184,8 @@ class RemoteExecutor(RealExecutor, ABC):
                 self.jobscript = f.read()
         except IOError as e:
             raise WorkflowError(e)
+        self._compiled_jobscript: Optional[CompiledTemplate] = None
+        self._compile_jobscript()
 
         if "{jobid}" not in self.jobname:
             raise WorkflowError(
@@ -76,18 +194,67 @@ class RemoteExecutor(RealExecutor, ABC):
             )
 
         self._tmpdir = None
+        self._job_exit_notification_dir_created = False
+        # names of the exit notifications of jobs that have been reported
+        self._finished_job_exit_notifications: Set[str] = set()
+
+        self.deploy_sources = (
+            self.common_settings.job_deploy_sources
+            or SharedFSUsage.SOURCES
+            not in self.workflow.storage_settings.shared_fs_usage
+        )
+        self._source_archive: Optional[SourceArchive] = None
+
+        self.job_exit_notifications = (
+            self.common_settings.job_exit_notifications
+            and SharedFSUsage.PERSISTENCE
+            in self.workflow.storage_settings.shared_fs_usage
+        )
 
+        self.submission_journal: Optional[SubmissionJournal] = None
+        if self.common_settings.submission_journal:
+            # set, since the common settings are taken from it
+            executor_plugin = self.workflow.executor_plugin
+            assert executor_plugin is not None
+            self.submission_journal = SubmissionJournal(
+                os.path.join(
+                    self.workflow.persistence.aux_path,
+                    "executor-journals",
+                    f"{executor_plugin.name}.jsonl",
+                )
+            )
+        # use this to run e.g. status queries within check_active_jobs
+        self.command_runner = AsyncCommandRunner(self.max_concurrent_commands)
+        self._shutdown_wait_timeout = None
+
+        # Active jobs are owned by the event loop.
+        # Submitted jobs are handed over via a deque (which is thread-safe),
+        # and drained into active_jobs before each status check.
         self.active_jobs = list()
+        # index of all active jobs, including those that are currently checked
+        self.active_job_store = ActiveJobStore()
+        self._job_poll_states: Dict[int, _JobPollState] = dict()
+        self._jobs_in_check: List[SubmittedJobInfo] = list()
+        self._submitted_jobs: Deque[SubmittedJobInfo] = deque()
+        # Not used by the executor anymore. Kept for plugins that use it to
+        # synchronize their own state.
         self.lock = threading.Lock()
         self.wait = True
-        self.wait_thread = threading.Thread(target=self._wait_thread)
-        self.wait_thread.daemon = True
-        self.wait_thread.start()
+        # set to interrupt the sleep between status checks
+        self._wakeup = asyncio.Event()
+        # The status checks run on the event loop that is shared by all
+        # executors, like any other coroutine of the executor.
+        self.event_loop_service = get_event_loop_service()
+        self.wait_future = self.event_loop_service.spawn(
+            self._wait_for_jobs(), on_error=self._handle_wait_error
+        )
+        self.wait_thread = _StatusCheckThread(self.wait_future)
 
         max_status_checks_frac = Fraction(
             self.max_status_checks_per_second
         ).limit_denominator()
-        self.status_rate_limiter = Throttler(
+        self.status_rate_limiter = _TimedThrottler(
+            self.metrics,
             rate_limit=max_status_checks_frac.numerator,
             period=max_status_checks_frac.denominator,
         )
@@ -103,12 +270,139 @@ class RemoteExecutor(RealExecutor, ABC):
         # otherwise, use whatever the node provides
         return "all"
 
+    def _collect_active_jobs(self) -> List[SubmittedJobInfo]:
+        return list(
+            {
+                id(job_info): job_info
+                for jobs in (
+                    self._jobs_in_check,
+                    self.active_jobs,
+                    self._submitted_jobs,
+                )
+                for job_info in list(jobs)
+            }.values()
+        )
+
+    def _snapshot_active_jobs(self) -> List[SubmittedJobInfo]:
+        """Return all active jobs, including those that are currently checked
+        and those that have not been drained from the handoff deque yet.
+
+        The event loop moves jobs between these structures, hence they are
+        collected in the event loop, where no job can be in between.
+        """
+        if self.event_loop_service.in_loop_thread():
+            return self._collect_active_jobs()
+
+        async def collect():
+            return self._collect_active_jobs()
+
+        try:
+            return self.event_loop_service.run(
+                collect(), timeout=self.cancel_snapshot_timeout
+            )
+        except concurrent.futures.TimeoutError:
+            # The event loop is blocked (e.g. by a plugin's status check),
+            # hence it does not move jobs either.
+            return self._collect_active_jobs()
+
     def cancel(self):
-        with self.lock:
-            active_jobs = list(self.active_jobs)
-        self.cancel_jobs(active_jobs)
+        active_jobs = self._snapshot_active_jobs()
+        # stop checking the jobs while they are cancelled
+        self.wait = False
+        deadline = (
+            None
+            if self.common_settings.cancel_timeout is None
+            else time.monotonic() + self.common_settings.cancel_timeout
+        )
+        unconfirmed = self._cancel_jobs_in_chunks(active_jobs, deadline)
+        unconfirmed_ids = {id(job_info) for job_info in unconfirmed}
+        for job_info in active_jobs:
+            if id(job_info) not in unconfirmed_ids:
+                self._journal_finished(job_info, success=False)
+        if unconfirmed:
+            self.logger.error(
+                f"Cancellation of {len(unconfirmed)} jobs could not be confirmed. "
+                "Please check and cancel them manually if necessary: "
+                + ", ".join(
+                    str(job_info.external_jobid)
+                    for job_info in unconfirmed
+                    if job_info.external_jobid is not None
+                )
+            )
+        if deadline is not None:
+            self._shutdown_wait_timeout = max(0, deadline - time.monotonic())
         self.shutdown()
 
+    def _cancel_jobs_in_chunks(
+        self, active_jobs: List[SubmittedJobInfo], deadline: Optional[float]
+    ) -> List[SubmittedJobInfo]:
+        """Call cancel_jobs for chunks of the given jobs concurrently, until
+        the deadline (in terms of time.monotonic()) has passed.
+
+        Returns the jobs whose cancellation has not been confirmed, i.e. for
+        which cancel_jobs has failed or not returned in time.
+        """
+        if not active_jobs:
+            return []
+        chunk_size = self.common_settings.cancel_chunk_size or len(active_jobs)
+        chunks = [
+            active_jobs[i : i + chunk_size]
+            for i in range(0, len(active_jobs), chunk_size)
+        ]
+        if len(chunks) == 1 and deadline is None:
+            # nothing to parallelize or to time out, cancel directly
+            self.cancel_jobs(active_jobs)
+            return []
+
+        pending: "queue.SimpleQueue[List[SubmittedJobInfo]]" = queue.SimpleQueue()
+        for chunk in chunks:
+            pending.put(chunk)
+        # cancelled chunks along with the error raised while cancelling them
+        results: "queue.SimpleQueue[Tuple[List[SubmittedJobInfo], Optional[Exception]]]"
+        results = queue.SimpleQueue()
+        stop = threading.Event()
+
+        def cancel_chunks():
+            while not stop.is_set():
+                try:
+                    chunk = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self.cancel_jobs(chunk)
+                    results.put((chunk, None))
+                except Exception as e:
+                    results.put((chunk, e))
+
+        n_threads = min(
+            len(chunks), max(1, self.common_settings.max_concurrent_cancels)
+        )
+        for _ in range(n_threads):
+            # Daemon threads, such that hanging calls of cancel_jobs do not
+            # prevent Snakemake from exiting.
+            threading.Thread(target=cancel_chunks, daemon=True).start()
+
+        unconfirmed = {id(chunk): chunk for chunk in chunks}
+        n_cancelled = 0
+        for _ in chunks:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            try:
+                if timeout is not None and timeout <= 0:
+                    raise queue.Empty()
+                chunk, error = results.get(timeout=timeout)
+            except queue.Empty:
+                self.logger.error("Timeout while cancelling jobs.")
+                stop.set()
+                break
+            if error is not None:
+                self.logger.error(f"Error cancelling jobs: {error}")
+                continue
+            del unconfirmed[id(chunk)]
+            n_cancelled += len(chunk)
+            if len(chunks) > 1:
+                self.logger.info(f"Cancelled {n_cancelled} of {len(active_jobs)} jobs.")
+        return [job_info for chunk in unconfirmed.values() for job_info in chunk]
+
     @abstractmethod
     def cancel_jobs(self, active_jobs: List[SubmittedJobInfo]):
         """Cancel the given jobs.
@@ -138,10 +432,11 @@ class RemoteExecutor(RealExecutor, ABC):
             # Only create extra file if we have more than 20 input files.
             # This should not require the file creation in most cases.
             if len(wait_for_files) > 20:
-                wait_for_files_file = self.get_jobscript(job) + ".waitforfilesfile.txt"
-                with open(wait_for_files_file, "w") as fd:
-                    print(*wait_for_files, sep="\n", file=fd)
-
+                wait_for_files_file = self.write_aux_file(
+                    self.tmpdir,
+                    "waitforfiles",
+                    "\n".join(wait_for_files) + "\n",
+                )
                 waitfiles_parameter = format_cli_arg(
                     "--wait-for-files-file", wait_for_files_file
                 )
@@ -150,12 +445,270 @@ class RemoteExecutor(RealExecutor, ABC):
 
         return f"{super().get_job_args(job)} {waitfiles_parameter}"
 
+    def get_source_archive(self) -> Optional[SourceArchive]:
+        """Return an archive of the workflow sources (dag.get_sources()), or
+        None if the sources need not be deployed to the jobs.
+
+        The archive is built once per run, and reused across runs as long as
+        the sources do not change. Plugins can use its digest to skip
+        uploading it again, and format_source_archive_extract_cmd() to
+        extract it in the job.
+        """
+        if not self.deploy_sources:
+            return None
+        if self._source_archive is None:
+            self._source_archive = build_source_archive(
+                self.dag.get_sources(),
+                os.path.join(self.workflow.persistence.aux_path, "source-archives"),
+                max_cached=self.max_cached_source_archives,
+            )
+        return self._source_archive
+
+    def get_aux_file_dir(self) -> Optional[str]:
+        if SharedFSUsage.PERSISTENCE in self.workflow.storage_settings.shared_fs_usage:
+            return self.tmpdir
+        return None
+
+    def run_jobs(self, jobs: List[JobExecutorInterface]):
+        if self.submission_journal is not None and self.submission_journal.running:
+            jobs = [job for job in jobs if not self._reattach_job(job)]
+        max_job_bundle_size = self.common_settings.max_job_bundle_size
+        if max_job_bundle_size is not None and max_job_bundle_size > 1:
+            jobs = bundle_jobs(
+                jobs,
+                max_job_bundle_size,
+                self.common_settings.max_bundled_job_runtime,
+            )
+        if inspect.iscoroutinefunction(self.run_job):
+            batch_jobs = []
+            single_jobs = []
+            for job in jobs:
+                if self._get_job_batch_key(job) is None:
+                    single_jobs.append(job)
+                else:
+                    batch_jobs.append(job)
+            self._run_jobs_async(single_jobs)
+            jobs = batch_jobs
+        super().run_jobs(jobs)
+
+    def _run_jobs_async(self, jobs: List[JobExecutorInterface]):
+        """Run the coroutine run_job for the given jobs concurrently on the
+        event loop and wait for all of them.
+
+        Submissions reported by run_job are passed on to the scheduler in the
+        order of the given jobs and from the calling thread, as if run_job had
+        been called one job after another.
+        """
+        if not jobs:
+            return
+        for job in jobs:
+            self.run_job_pre(job)
+
+        async def run_all():
+            # Collect the submissions of this call only, run_jobs may be called
+            # again (e.g. from another thread) before it returns. The tasks
+            # created by gather inherit the context of this one.
+            submissions: _AsyncSubmissions = dict()
+            _async_submissions.set(submissions)
+            semaphore = asyncio.Semaphore(
+                max(1, self.common_settings.max_concurrent_submissions)
+            )
+
+            async def run(job):
+                async with semaphore:
+                    with self.tracer.job_span(job, "submit"):
+                        start = time.perf_counter()
+                        await self.run_job(job)
+                        self.metrics.submit_seconds.observe(time.perf_counter() - start)
+
+            results = await asyncio.gather(
+                *(run(job) for job in jobs), return_exceptions=True
+            )
+            return results, submissions
+
+        results, submissions = self.event_loop_service.run(run_all())
+        for job in jobs:
+            for job_info, register_job in submissions.get(id(job), []):
+                self.report_job_submission(job_info, register_job=register_job)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _reattach_job(self, job: JobExecutorInterface) -> bool:
+        """Add the given job to the active jobs instead of submitting it, if
+        it is still running according to the submission journal.
+        """
+        assert self.submission_journal is not None
+        record = self.submission_journal.pop_running(
+            job, self.dag.incomplete_external_jobid(job)
+        )
+        if record is None:
+            return False
+        self.logger.info(
+            f"Reattaching to job {record['external_jobid']} submitted by a "
+            "previous run."
+        )
+        self.run_job_pre(job)
+        self.report_job_submission(
+            SubmittedJobInfo(
+                job, external_jobid=record["external_jobid"], aux=record["aux"]
+            ),
+            register_job=False,
+        )
+        return True
+
+    def _journal_finished(self, job_info: SubmittedJobInfo, success: bool):
+        if self.submission_journal is None:
+            return
+        for bundled_job_info in self._unbundle(job_info):
+            if bundled_job_info.external_jobid is not None:
+                self.submission_journal.finished(bundled_job_info, success)
+
+    def format_job_exec(self, job: JobExecutorInterface) -> str:
+        if isinstance(job, JobBundle):
+            return self.format_bundle_exec(job)
+        with self.tracer.job_span(job, "build command"):
+            return super().format_job_exec(job)
+
+    @property
+    def bundled_job_exit_dir(self):
+        return os.path.join(self.tmpdir, "bundled-job-exits")
+
+    def _bundled_job_exit_path(self, job: JobExecutorInterface) -> Optional[str]:
+        if self.get_aux_file_dir() is None:
+            return None
+        return os.path.join(
+            self.bundled_job_exit_dir, self._job_exit_notification_name(job)
+        )
+
+    def format_bundle_exec(self, bundle: JobBundle) -> str:
+        """Return the command that runs the jobs of the given bundle one after
+        another.
+
+        Each job writes its exit status into a file in the executor's tmpdir
+        (if it is on a shared filesystem), such that the jobs of a failed
+        bundle can be reported individually. The command exits with the
+        status of the last failed job, or zero if all jobs succeeded.
+        """
+        commands = ["_snakemake_bundle_status=0"]
+        for job in bundle:
+            command = f"{{ {self.format_job_exec(job)}; }}; _snakemake_job_status=$?"
+            path = self._bundled_job_exit_path(job)
+            if path is not None:
+                os.makedirs(self.bundled_job_exit_dir, exist_ok=True)
+                command += f"; echo $_snakemake_job_status > {shlex.quote(path)}"
+            command += (
+                "; [ $_snakemake_job_status -eq 0 ] || "
+                "_snakemake_bundle_status=$_snakemake_job_status"
+            )
+            commands.append(command)
+        commands.append("(exit $_snakemake_bundle_status)")
+        return "; ".join(commands)
+
+    def _get_bundled_job_exit_status(self, job: JobExecutorInterface) -> Optional[int]:
+        path = self._bundled_job_exit_path(job)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            # the job did not run, or it was killed together with the bundle
+            return None
+
+    def _unbundle(self, job_info: SubmittedJobInfo) -> List[SubmittedJobInfo]:
+        """Return one SubmittedJobInfo per job of a job bundle (or the given
+        one if it is not a bundle).
+        """
+        if not isinstance(job_info.job, JobBundle):
+            return [job_info]
+        return [
+            SubmittedJobInfo(
+                job, external_jobid=job_info.external_jobid, aux=job_info.aux
+            )
+            for job in job_info.job
+        ]
+
     def report_job_submission(
         self, job_info: SubmittedJobInfo, register_job: bool = True
     ):
-        super().report_job_submission(job_info, register_job=register_job)
-        with self.lock:
-            self.active_jobs.append(job_info)
+        submissions = _async_submissions.get()
+        if submissions is not None:
+            # reported by an async run_job, see _run_jobs_async
+            submissions.setdefault(id(job_info.job), []).append(
+                (job_info, register_job)
+            )
+            return
+        for bundled_job_info in self._unbundle(job_info):
+            super().report_job_submission(bundled_job_info, register_job=register_job)
+            self.tracer.set_job_state(
+                bundled_job_info.job,
+                "submitted",
+                external_jobid=bundled_job_info.external_jobid,
+            )
+            if (
+                self.submission_journal is not None
+                and bundled_job_info.external_jobid is not None
+            ):
+                self.submission_journal.submitted(bundled_job_info)
+        # bundles stay active as a whole, they are a single remote job
+        self._submitted_jobs.append(job_info)
+
+    def report_job_status(self, job_info: SubmittedJobInfo, status: Hashable):
+        """Report the current state of an active job, as given by the
+        cluster or cloud (e.g. "PENDING" or "RUNNING").
+
+        Calling this from check_active_jobs is optional. If
+        common_settings.max_status_check_staleness is set, jobs whose state
+        has changed recently are checked more often. If tracing is enabled,
+        the states are recorded as spans of the job.
+        """
+        if self.tracer.enabled:
+            for bundled_job_info in self._unbundle(job_info):
+                self.tracer.set_job_state(bundled_job_info.job, str(status))
+        state = self._job_poll_states.get(id(job_info))
+        if state is not None and state.status != status:
+            if state.status is not None:
+                state.changed = time.monotonic()
+            state.status = status
+
+    def _job_finished(self, job_info: SubmittedJobInfo):
+        self.active_job_store.discard(job_info)
+        self._job_poll_states.pop(id(job_info), None)
+        if not self._reporting_notified_jobs:
+            # jobs reported via their exit notification do not call for more
+            # frequent status checks
+            self._n_job_state_changes += 1
+        if self.job_exit_notifications:
+            # its notification is removed by the watcher
+            self._finished_job_exit_notifications.add(
+                self._job_exit_notification_name(job_info.job)
+            )
+
+    def report_job_success(self, job_info: SubmittedJobInfo):
+        self._job_finished(job_info)
+        self._journal_finished(job_info, success=True)
+        for bundled_job_info in self._unbundle(job_info):
+            self.tracer.set_job_state(bundled_job_info.job, None, success=True)
+            super().report_job_success(bundled_job_info)
+
+    def report_job_error(self, job_info: SubmittedJobInfo, msg=None, **kwargs):
+        self._job_finished(job_info)
+        self._journal_finished(job_info, success=False)
+        if not isinstance(job_info.job, JobBundle):
+            self.tracer.set_job_state(job_info.job, None, success=False)
+            super().report_job_error(job_info, msg=msg, **kwargs)
+            return
+        # Some jobs of a failed bundle may have succeeded. Only their recorded
+        # exit status tells, since the output of a job that has been killed
+        # may exist but be incomplete.
+        for bundled_job_info in self._unbundle(job_info):
+            if self._get_bundled_job_exit_status(bundled_job_info.job) == 0:
+                self.tracer.set_job_state(bundled_job_info.job, None, success=True)
+                super().report_job_success(bundled_job_info)
+            else:
+                self.tracer.set_job_state(bundled_job_info.job, None, success=False)
+                super().report_job_error(bundled_job_info, msg=msg, **kwargs)
 
     @abstractmethod
     async def check_active_jobs(
@@ -169,39 +722,336 @@ class RemoteExecutor(RealExecutor, ABC):
         For jobs that have errored, you have to call
         self.report_job_error(job).
         Jobs that are still running have to be yielded.
+
+        If common_settings.status_check_chunk_size is set, this method is
+        called concurrently for chunks of the active jobs.
+
+        This method runs in the event loop of the executor. Instead of
+        blocking calls of subprocess, use self.command_runner to run status
+        commands. To look up active jobs by their external jobid (e.g. when
+        parsing a status table), use self.active_job_store.
         """
         ...
 
-    async def _wait_for_jobs(self):
-        await asyncio.sleep(
-            self.workflow.executor_plugin.common_settings.init_seconds_before_status_checks
+    def _drain_submitted_jobs(self):
+        """Move jobs handed over by report_job_submission into active_jobs.
+
+        Must only be called from within the event loop of the executor.
+        """
+        submitted_jobs = self._submitted_jobs
+        if submitted_jobs and self.common_settings.max_status_check_staleness:
+            now = time.monotonic()
+            for job_info in submitted_jobs:
+                self._job_poll_states[id(job_info)] = _JobPollState(now)
+        while submitted_jobs:
+            job_info = submitted_jobs.popleft()
+            self.active_jobs.append(job_info)
+            self.active_job_store.add(job_info)
+            self._n_job_state_changes += 1
+
+    async def _check_active_jobs(
+        self, active_jobs: List[SubmittedJobInfo]
+    ) -> List[SubmittedJobInfo]:
+        """Check the given jobs and return those that are still active.
+
+        If the plugin specifies a status_check_chunk_size, the jobs are split into
+        chunks which are checked concurrently (at most
+        max_concurrent_status_checks at a time).
+        """
+        chunk_size = self.common_settings.status_check_chunk_size
+        if not chunk_size or len(active_jobs) <= chunk_size:
+            return [job_info async for job_info in self._iter_active_jobs(active_jobs)]
+
+        semaphore = asyncio.Semaphore(
+            max(1, self.common_settings.max_concurrent_status_checks)
+        )
+
+        async def check_chunk(chunk: List[SubmittedJobInfo]):
+            async with semaphore:
+                return [job_info async for job_info in self._iter_active_jobs(chunk)]
+
+        # Let all chunks finish even if one of them fails, such that no job is
+        # reported after the caller has put the unreported jobs back.
+        results = await asyncio.gather(
+            *(
+                check_chunk(active_jobs[i : i + chunk_size])
+                for i in range(0, len(active_jobs), chunk_size)
+            ),
+            return_exceptions=True,
         )
-        while True:
-            async with async_lock(self.lock):
+        still_active_jobs: List[SubmittedJobInfo] = []
+        for chunk_result in results:
+            if isinstance(chunk_result, BaseException):
+                raise chunk_result
+            still_active_jobs.extend(chunk_result)
+        return still_active_jobs
+
+    def _iter_active_jobs(
+        self, active_jobs: List[SubmittedJobInfo]
+    ) -> AsyncIterator[SubmittedJobInfo]:
+        # check_active_jobs is an async generator, despite its annotation
+        return cast(
+            AsyncIterator[SubmittedJobInfo], self.check_active_jobs(active_jobs)
+        )
+
+    def _select_due_jobs(self, active_jobs: List[SubmittedJobInfo]):
+        """Split the given jobs into those that are due for a status check and
+        those that are not (see max_status_check_staleness).
+        """
+        max_staleness = self.common_settings.max_status_check_staleness
+        if not max_staleness:
+            return active_jobs, []
+        now = time.monotonic()
+        min_interval = self.next_seconds_between_status_checks
+        factor = self.status_check_age_factor
+        due = []
+        deferred = []
+        for job_info in active_jobs:
+            state = self._job_poll_states.get(id(job_info))
+            if state is None:
+                due.append(job_info)
+                continue
+            interval = min(
+                max(min_interval, (now - state.changed) * factor), max_staleness
+            )
+            # check now if the job would be overdue in the next cycle
+            if now + min_interval - state.checked > interval:
+                state.checked = now
+                due.append(job_info)
+            else:
+                deferred.append(job_info)
+        return due, deferred
+
+    async def _poll_active_jobs(self):
+        """Perform a single status check of all active jobs (or only of those
+        that are due, if max_status_check_staleness is set).
+        """
+        self._drain_submitted_jobs()
+        # Jobs under check are taken out of active_jobs, such that the
+        # job exit notification watcher does not report them in parallel.
+        all_active_jobs, self.active_jobs = self.active_jobs, []
+        self._jobs_in_check = all_active_jobs
+        active_jobs, deferred_jobs = self._select_due_jobs(all_active_jobs)
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        try:
+            still_active_jobs = await self._check_active_jobs(active_jobs)
+        except BaseException:
+            # Keep the jobs that have not been reported yet, such that they are
+            # checked again in the next cycle.
+            self.active_jobs = [
+                job_info
+                for job_info in all_active_jobs
+                if job_info in self.active_job_store
+            ] + self.active_jobs
+            self._jobs_in_check = []
+            raise
+        self.metrics.status_check_seconds.observe(time.perf_counter() - start)
+        self.tracer.add_span(
+            "status check",
+            start_ns,
+            status_checks_track,
+            checked_jobs=len(active_jobs),
+            active_jobs=len(all_active_jobs),
+        )
+        if self.common_settings.adaptive_status_checks:
+            self._adapt_seconds_between_status_checks()
+        # re-add the remaining jobs to active_jobs
+        still_active_jobs.extend(deferred_jobs)
+        still_active_jobs.extend(self.active_jobs)
+        self.active_jobs = still_active_jobs
+        if len(self.active_job_store) != len(still_active_jobs):
+            # check_active_jobs has dropped jobs without reporting them
+            self.active_job_store = ActiveJobStore(still_active_jobs)
+            if self._job_poll_states:
+                self._job_poll_states = {
+                    id(job_info): self._job_poll_states[id(job_info)]
+                    for job_info in still_active_jobs
+                    if id(job_info) in self._job_poll_states
+                }
+        self._jobs_in_check = []
+        self.metrics.active_jobs.set(len(self.active_jobs))
+        if (
+            self.metrics.exporters
+            and time.monotonic() - self._last_metrics_export
+            >= self.metrics_export_seconds
+        ):
+            self._export_metrics()
+
+    async def _wait_for_jobs(self):
+        notification_watcher = None
+        if self.job_exit_notifications:
+            notification_watcher = asyncio.create_task(
+                self._watch_job_exit_notifications()
+            )
+        try:
+            await self._interruptible_sleep(
+                self.workflow.executor_plugin.common_settings.init_seconds_before_status_checks
+            )
+            n_errors = 0
+            while True:
                 if not self.wait:
                     return
-                active_jobs = list(self.active_jobs)
-                self.active_jobs.clear()
-            still_active_jobs = [
-                job_info async for job_info in self.check_active_jobs(active_jobs)
-            ]
-            async with async_lock(self.lock):
-                # re-add the remaining jobs to active_jobs
-                self.active_jobs.extend(still_active_jobs)
-            await self.sleep()
-
-    def _wait_thread(self):
+                try:
+                    await self._poll_active_jobs()
+                    n_errors = 0
+                except self.transient_status_check_errors as e:
+                    # Tolerate transient errors, but give up if the status
+                    # checks keep failing.
+                    n_errors += 1
+                    if n_errors >= self.max_consecutive_status_check_errors:
+                        raise
+                    self.logger.error(
+                        f"Error checking the status of active jobs, will retry: {e}"
+                    )
+                await self.sleep()
+        finally:
+            if notification_watcher is not None:
+                notification_watcher.cancel()
+
+    @property
+    def job_exit_notification_dir(self):
+        return os.path.join(self.tmpdir, "job-exits")
+
+    def _job_exit_notification_name(self, job: JobExecutorInterface):
+        return f"{job.jobid}.{job.attempt}"
+
+    def get_job_exit_notification_cmd(self, job: JobExecutorInterface) -> str:
+        """Return a shell command that notifies the executor about the exit of
+        the given job.
+
+        The command has to be executed directly after the job command (it
+        evaluates $? and exits with the same status). An empty string is
+        returned if job exit notifications are disabled.
+        """
+        if not self.job_exit_notifications:
+            return ""
+        if not self._job_exit_notification_dir_created:
+            os.makedirs(self.job_exit_notification_dir, exist_ok=True)
+            self._job_exit_notification_dir_created = True
+        path = shlex.quote(
+            os.path.join(
+                self.job_exit_notification_dir, self._job_exit_notification_name(job)
+            )
+        )
+        return (
+            f"_snakemake_job_status=$?; echo $_snakemake_job_status > {path}.tmp "
+            f"&& mv {path}.tmp {path}; exit $_snakemake_job_status"
+        )
+
+    async def _watch_job_exit_notifications(self):
+        """Report jobs as finished as soon as their exit notification appears.
+
+        Jobs that are currently checked via check_active_jobs are not part of
+        self.active_jobs. Their notification is therefore only processed in case
+        they are still active after the check, which ensures that no job is
+        reported twice.
+        """
+        while self.wait:
+            await asyncio.sleep(self.job_exit_notification_check_seconds)
+            try:
+                await self._process_job_exit_notifications()
+            except Exception as e:
+                # polling via check_active_jobs remains as a fallback
+                self.logger.error(f"Error processing job exit notifications: {e}")
+
+    async def _process_job_exit_notifications(self):
+        # Notifications of jobs that have been reported already (e.g. because
+        # polling has seen them finish first) are removed.
+        finished = set(self._finished_job_exit_notifications)
+        # file I/O must not block the event loop
+        notifications, removed = await asyncio.to_thread(
+            self._scan_job_exit_notifications, finished
+        )
+        self._finished_job_exit_notifications.difference_update(removed)
+        if not notifications:
+            return
+
+        self._drain_submitted_jobs()
+        notified = []
+        still_active_jobs = []
+        for job_info in self.active_jobs:
+            status = notifications.get(self._job_exit_notification_name(job_info.job))
+            if status is None:
+                still_active_jobs.append(job_info)
+            else:
+                notified.append((job_info, status))
+        if notified:
+            self.active_jobs = still_active_jobs
+
+        self._reporting_notified_jobs = True
+        try:
+            for job_info, status in notified:
+                if status == 0:
+                    self.report_job_success(job_info)
+                else:
+                    self.report_job_error(
+                        job_info, msg=f"Job exited with status {status}. "
+                    )
+        finally:
+            self._reporting_notified_jobs = False
+
+    def _scan_job_exit_notifications(self, finished: Set[str]):
+        """Read the exit status of all notifications, except for those in
+        finished, which are removed instead.
+
+        Returns the exit status by notification name and the names of the
+        removed notifications. Unreadable or invalid notifications are
+        removed as well, their jobs are left to check_active_jobs.
+        """
+        notifications: Dict[str, int] = dict()
+        removed: List[str] = []
+        dirname = self.job_exit_notification_dir
         try:
-            asyncio.run(self._wait_for_jobs())
+            names = os.listdir(dirname)
+        except FileNotFoundError:
+            return notifications, removed
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(dirname, name)
+            if name not in finished:
+                try:
+                    with open(path) as f:
+                        notifications[name] = int(f.read())
+                    continue
+                except (OSError, ValueError) as e:
+                    self.logger.error(f"Invalid job exit notification {path}: {e}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            removed.append(name)
+        return notifications, removed
+
+    def _handle_wait_error(self, e: BaseException):
+        self.logger.error(f"Error checking the status of active jobs: {e}")
+        if self.workflow.scheduler is not None:
+            if not isinstance(e, Exception):
+                # e.g. a KeyboardInterrupt raised in the loop thread
+                e = WorkflowError(f"Checking the status of active jobs failed: {e!r}")
+            self.workflow.scheduler.executor_error_callback(e)
+
+    def _export_metrics(self):
+        self._last_metrics_export = time.monotonic()
+        try:
+            self.metrics.export()
         except Exception as e:
-            print(e)
-            if self.workflow.scheduler is not None:
-                self.workflow.scheduler.executor_error_callback(e)
+            self.logger.error(f"Error exporting executor metrics: {e}")
 
     def shutdown(self):
-        with self.lock:
-            self.wait = False
-        self.wait_thread.join()
+        self.wait = False
+        self.event_loop_service.loop.call_soon_threadsafe(self._wakeup.set)
+        concurrent.futures.wait([self.wait_future], timeout=self._shutdown_wait_timeout)
+        if self.metrics.exporters:
+            self._export_metrics()
+        if self.tracer.enabled:
+            try:
+                self.tracer.export()
+            except Exception as e:
+                self.logger.error(f"Error exporting executor trace: {e}")
+        if self.submission_journal is not None:
+            self.submission_journal.close()
         if not self.workflow.remote_execution_settings.immediate_submit:
             # Only delete tmpdir (containing jobscripts) if not using
             # immediate_submit. With immediate_submit, jobs can be scheduled
@@ -229,11 +1079,32 @@ class RemoteExecutor(RealExecutor, ABC):
 
         return os.path.join(self.tmpdir, f)
 
-    def write_jobscript(self, job: JobExecutorInterface, jobscript):
+    def _compile_jobscript(self) -> CompiledTemplate:
+        # The template is compiled once, unless a plugin replaces self.jobscript.
+        compiled = self._compiled_jobscript
+        if compiled is None or compiled.template is not self.jobscript:
+            try:
+                compiled = CompiledTemplate(self.jobscript)
+            except ValueError as e:
+                if self.is_default_jobscript:
+                    raise e
+                raise WorkflowError(
+                    f"Error parsing custom jobscript {self.jobscript}: {e}"
+                )
+            self._compiled_jobscript = compiled
+        return compiled
+
+    def format_jobscript(self, job: JobExecutorInterface) -> str:
+        """Return the content of the jobscript for the given job."""
         exec_job = self.format_job_exec(job)
+        job_exit_notification = self.get_job_exit_notification_cmd(job)
+        if job_exit_notification:
+            # Appended to the job command, such that custom jobscripts need
+            # no additional placeholder.
+            exec_job = f"{exec_job}\n{job_exit_notification}"
 
         try:
-            content = self.jobscript.format(
+            content = self._compile_jobscript().format(
                 properties=job.properties(),
                 exec_job=exec_job,
             )
@@ -249,9 +1120,32 @@ class RemoteExecutor(RealExecutor, ABC):
                 )
 
         self.logger.debug(f"Jobscript:\n{content}")
-        with open(jobscript, "w") as f:
-            print(content, file=f)
-        os.chmod(jobscript, os.stat(jobscript).st_mode | stat.S_IXUSR | stat.S_IRUSR)
+        return content
+
+    def render_jobscript(self, job: JobExecutorInterface) -> bytes:
+        """Return the jobscript for the given job as bytes.
+
+        This allows to pass the jobscript directly to the stdin of a
+        submission command (e.g. sbatch) without writing it to the filesystem
+        first.
+        """
+        return f"{self.format_jobscript(job)}\n".encode()
+
+    def write_jobscript(self, job: JobExecutorInterface, jobscript):
+        with self.tracer.job_span(job, "write jobscript"):
+            self._write_jobscript(job, jobscript)
+
+    def _write_jobscript(self, job: JobExecutorInterface, jobscript):
+        content = self.render_jobscript(job)
+        # Create the file as readable and executable for the user right away
+        # (subject to the umask), avoiding a separate stat and chmod.
+        fd = os.open(
+            jobscript,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            stat.S_IRWXU | stat.S_IRGRP | stat.S_IROTH,
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
 
     def handle_job_success(self, job: JobExecutorInterface):
         super().handle_job_success(job)
@@ -266,20 +1160,61 @@ class RemoteExecutor(RealExecutor, ABC):
             kwargs["external_jobid"] = job_info.external_jobid
         super().print_job_error(job_info, msg=msg, **kwargs)
 
+    def _adapt_seconds_between_status_checks(self):
+        """Back off if no job has been submitted or has finished since the
+        last check, otherwise tighten the interval, staying within the bounds
+        given by the common settings.
+
+        Jobs deferred by tiered polling (see max_status_check_staleness) do
+        not count as changes. The interval does not exceed the maximum
+        staleness though, since no job can be checked more often than once
+        per cycle.
+        """
+        n_changes = self._n_job_state_changes
+        self._n_job_state_changes = 0
+
+        current = self._adaptive_seconds_between_status_checks
+        if current is None:
+            current = (
+                self.workflow.remote_execution_settings.seconds_between_status_checks
+            )
+        if n_changes:
+            current /= self.status_check_backoff_factor
+        else:
+            current *= self.status_check_backoff_factor
+        max_seconds = self.common_settings.max_seconds_between_status_checks
+        if self.common_settings.max_status_check_staleness:
+            max_seconds = min(
+                max_seconds, self.common_settings.max_status_check_staleness
+            )
+        self._adaptive_seconds_between_status_checks = min(
+            max(current, self.common_settings.min_seconds_between_status_checks),
+            max_seconds,
+        )
+
+    async def _interruptible_sleep(self, seconds: float):
+        """Sleep for the given time, or until shutdown() is called."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
     async def sleep(self):
         duration = (
             self.workflow.remote_execution_settings.seconds_between_status_checks
             if self.next_seconds_between_status_checks is None
             else self.next_seconds_between_status_checks
         )
-        await asyncio.sleep(duration)
+        await self._interruptible_sleep(duration)
 
     @property
     def next_seconds_between_status_checks(self):
-        if self._next_seconds_between_status_checks is None:
-            return self.workflow.remote_execution_settings.seconds_between_status_checks
-        else:
+        if self._next_seconds_between_status_checks is not None:
             return self._next_seconds_between_status_checks
+        elif self._adaptive_seconds_between_status_checks is not None:
+            return self._adaptive_seconds_between_status_checks
+        else:
+            return self.workflow.remote_execution_settings.seconds_between_status_checks
 
     @next_seconds_between_status_checks.setter
     def next_seconds_between_status_checks(self, value):
@@ -0,0 +1,200 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+from dataclasses import dataclass
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import tarfile
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from snakemake_interface_common.exceptions import WorkflowError
+
+
+@dataclass(frozen=True)
+class SourceArchive:
+    """A tar.gz archive of the workflow sources.
+
+    The archive is named by the digest of the sources (their paths and
+    content). Archives with the same digest have the same content.
+    """
+
+    path: str
+    digest: str
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_digest_index(path: str) -> Dict[str, List]:
+    try:
+        with open(path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    return index if isinstance(index, dict) else dict()
+
+
+def _normalize_source_path(path: str) -> str:
+    normalized = os.path.normpath(path)
+    # the archive is extracted into the working directory of the jobs
+    if os.path.isabs(normalized) or normalized.split(os.sep)[0] == os.pardir:
+        raise WorkflowError(
+            f"Workflow source {path} is outside of the working directory. "
+            "Sources can only be deployed to the jobs if they are given "
+            "relative to the working directory and inside of it."
+        )
+    return normalized
+
+
+def get_sources_digest(
+    sources: Iterable[str], index_path: Optional[str] = None
+) -> Tuple[str, List[str]]:
+    """Return the digest of the given source files, and the files in the
+    order in which they are archived.
+
+    If index_path is given, the digests of the individual files are cached
+    there by path, modification time and size, such that unchanged files are
+    not read again in the next run.
+    """
+    paths = sorted({_normalize_source_path(path) for path in sources})
+    index = _load_digest_index(index_path) if index_path else dict()
+    new_index = dict()
+    h = hashlib.sha256()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise WorkflowError(f"Failed to read workflow source {path}: {e}")
+        if not os.path.isfile(path):
+            # tarfile.add would add directories recursively
+            raise WorkflowError(f"Workflow source {path} is not a file.")
+        entry = index.get(path)
+        if entry is None or entry[:2] != [st.st_mtime_ns, st.st_size]:
+            entry = [st.st_mtime_ns, st.st_size, _file_digest(path)]
+        new_index[path] = entry
+        h.update(f"{path}\0{entry[2]}\0{st.st_mode & 0o111:o}\n".encode())
+    if index_path and new_index != index:
+        _write_atomic(index_path, json.dumps(new_index).encode())
+    return h.hexdigest(), paths
+
+
+def _write_atomic(path: str, content: bytes):
+    dirname = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".tmp.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _normalize_tarinfo(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+    # the archive must not depend on the user that builds it
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    return tarinfo
+
+
+def build_source_archive(
+    sources: Iterable[str], cache_dir: str, max_cached: int = 3
+) -> SourceArchive:
+    """Return an archive of the given source files in cache_dir, building it
+    only if no archive with the same digest exists there.
+
+    Of the other archives in cache_dir, only the max_cached - 1 most recently
+    used ones are kept.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    digest, paths = get_sources_digest(
+        sources, index_path=os.path.join(cache_dir, "index.json")
+    )
+    path = os.path.join(os.path.abspath(cache_dir), f"sources.{digest}.tar.gz")
+    if os.path.exists(path):
+        # mark as recently used
+        os.utime(path)
+    else:
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".tmp.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # omit the timestamp from the gzip header
+                with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                    with tarfile.open(fileobj=gz, mode="w") as tar:
+                        for source in paths:
+                            tar.add(source, filter=_normalize_tarinfo)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    _prune_source_archives(cache_dir, keep=path, max_cached=max_cached)
+    return SourceArchive(path=path, digest=digest)
+
+
+def _prune_source_archives(cache_dir: str, keep: str, max_cached: int):
+    archives = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(os.path.abspath(cache_dir), name)
+        if name.startswith("sources.") and name.endswith(".tar.gz") and path != keep:
+            try:
+                archives.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass
+    archives.sort(reverse=True)
+    for _, path in archives[max(0, max_cached - 1) :]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _extraction_marker(dest: str, digest: str) -> str:
+    return os.path.join(dest, ".snakemake", "source-archives", f"{digest}.extracted")
+
+
+def extract_source_archive(path: str, digest: str, dest: str = ".") -> bool:
+    """Extract the given source archive into dest, unless an archive with the
+    same digest has already been extracted there.
+
+    Returns True if the archive has been extracted.
+    """
+    marker = _extraction_marker(dest, digest)
+    if os.path.exists(marker):
+        return False
+    with tarfile.open(path, "r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dest, filter="data")
+        else:
+            tar.extractall(dest)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, "w").close()
+    return True
+
+
+def format_source_archive_extract_cmd(path: str, digest: str) -> str:
+    """Return a shell command that extracts the given source archive into
+    the working directory of a job, unless it has already been extracted
+    there (e.g. by a previous job on the same node).
+    """
+    marker = _extraction_marker(".", digest)
+    return (
+        f"{{ [ -e {shlex.quote(marker)} ] || "
+        f"{{ tar -xzf {shlex.quote(path)} && "
+        f"mkdir -p {shlex.quote(os.path.dirname(marker))} && "
+        f"touch {shlex.quote(marker)}; }}; }}"
+    )
@@ -0,0 +1,244 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+from abc import ABC, abstractmethod
+import bisect
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Environment variable that, if set, makes executors export their metrics
+# in the Prometheus text format to the given file.
+metrics_file_envvar = "SNAKEMAKE_EXECUTOR_METRICS_FILE"
+
+default_buckets = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metric(ABC):
+    type: str
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        """Yield (name, labels, value) for each sample of this metric."""
+        ...
+
+    def to_prometheus_text(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {value!r}"
+            for name, labels, value in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = default_buckets
+    ):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+        # per labels: bucket counts (last one is +Inf), sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _labels(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(_labels(labels))
+        return sum(entry[0]) if entry else 0
+
+    def sum(self, **labels: str) -> float:
+        entry = self._values.get(_labels(labels))
+        return entry[1][0] if entry else 0.0
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._values.items()
+            ]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", labels + (("le", le),), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsExporterBase(ABC):
+    @abstractmethod
+    def export(self, metrics: "ExecutorMetrics") -> None: ...
+
+
+class PrometheusTextfileExporter(MetricsExporterBase):
+    """Write metrics in the Prometheus text format to a file.
+
+    The file is replaced atomically, such that it can be picked up e.g. by the
+    textfile collector of the Prometheus node exporter.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, metrics: "ExecutorMetrics") -> None:
+        content = metrics.to_prometheus_text()
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".metrics.")
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        # mkstemp creates the file as private, but e.g. the node exporter
+        # usually runs as a different user
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, self.path)
+
+
+class ExecutorMetrics:
+    """Metrics about the executor layer itself.
+
+    Executors record into this object, and the registered exporters write it
+    out on export().
+    """
+
+    def __init__(self):
+        self.submissions = Counter(
+            "snakemake_executor_job_submissions_total",
+            "Number of submitted jobs.",
+        )
+        self.successes = Counter(
+            "snakemake_executor_job_successes_total",
+            "Number of successfully finished jobs.",
+        )
+        self.errors = Counter(
+            "snakemake_executor_job_errors_total",
+            "Number of failed jobs.",
+        )
+        self.submit_seconds = Histogram(
+            "snakemake_executor_submit_seconds",
+            "Duration of calls submitting jobs (run_job, run_job_batch).",
+        )
+        self.status_check_seconds = Histogram(
+            "snakemake_executor_status_check_seconds",
+            "Duration of checking the status of all active jobs.",
+        )
+        self.throttle_wait_seconds = Histogram(
+            "snakemake_executor_status_throttle_wait_seconds",
+            "Time spent waiting for the status rate limiter.",
+        )
+        self.active_jobs = Gauge(
+            "snakemake_executor_active_jobs",
+            "Number of active jobs after the last status check.",
+        )
+        self.exporters: List[MetricsExporterBase] = []
+        path = os.environ.get(metrics_file_envvar)
+        if path:
+            self.exporters.append(PrometheusTextfileExporter(path))
+
+    def metrics(self) -> List[Metric]:
+        return [
+            self.submissions,
+            self.successes,
+            self.errors,
+            self.submit_seconds,
+            self.status_check_seconds,
+            self.throttle_wait_seconds,
+            self.active_jobs,
+        ]
+
+    def to_prometheus_text(self) -> str:
+        text = "\n".join(metric.to_prometheus_text() for metric in self.metrics())
+        return f"{text}\n"
+
+    def export(self):
+        for exporter in self.exporters:
+            exporter.export(self)
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, Sequence, Set
+from typing import List, Optional, Sequence, Set
 
 from snakemake_interface_common.settings import SettingsEnumBase, TSettingsEnumBase
 
@@ -57,6 +57,104 @@ class CommonSettings:
         Indicates whether the plugin can transfer local files to the remote executor when
         run without a shared FS. If true, it's the plugin's responsibility and not
         Snakemake's to manage file transfers.
+    status_check_chunk_size: Optional[int]
+        If set, active jobs are split into chunks of this size and
+        check_active_jobs is called once per chunk. This is useful for
+        executors that can query the status of many jobs with a single call.
+    max_concurrent_status_checks: int
+        Maximum number of chunks (see status_check_chunk_size) that are
+        checked concurrently. Queries should still be wrapped into
+        self.status_rate_limiter.
+    job_exit_notifications: bool
+        Whether spawned jobs shall notify the executor about their exit by
+        writing a small file into the executor's tmpdir. Notified jobs are
+        reported immediately, while polling via check_active_jobs remains as a
+        fallback. Only effective if the .snakemake directory is on a shared
+        filesystem (see SharedFSUsage.PERSISTENCE) and the plugin either uses
+        the jobscript (see RemoteExecutor.write_jobscript) or appends
+        RemoteExecutor.get_job_exit_notification_cmd() to the job command.
+    adaptive_status_checks: bool
+        Whether to adapt the time between status checks to the observed job
+        state changes: the interval grows while no job is submitted or
+        finishes between two checks, and shrinks otherwise. Jobs reported via
+        job exit notifications are not counted. Has no effect while the
+        plugin sets RemoteExecutor.next_seconds_between_status_checks.
+    min_seconds_between_status_checks: float
+        Lower bound for the adaptive time between status checks.
+    max_seconds_between_status_checks: float
+        Upper bound for the adaptive time between status checks. If
+        max_status_check_staleness is smaller, that is the upper bound.
+    max_inline_job_args_size: Optional[int]
+        If set, the maximum size (in bytes, UTF-8 encoded) of the job specific
+        arguments (e.g. target jobs, allowed rules, unneeded temp files) in the
+        job command. Larger arguments are written to a file that the job command
+        sources, provided that the executor has a directory that is shared with
+        the spawned jobs. The job command then refers to the arguments via "$@".
+        Hence, only set this if the plugin passes the job command as a single
+        quoted argument to a POSIX shell (e.g. sh -c 'command' or a jobscript),
+        such that "$@" is not expanded by an outer shell, and if its precommand
+        does not reset the positional parameters.
+    max_job_bundle_size: Optional[int]
+        If set, remote executors combine jobs that are ready at the same time,
+        are neither local nor group jobs, and have equal resources, threads and
+        attempt into bundles of at most this many jobs. Each bundle is
+        submitted as a single remote job that runs its jobs one after another.
+        The runtime resource of a bundle is the sum of the runtimes of its
+        jobs. This is useful for many very short jobs, where the scheduling
+        overhead dominates. run_job and get_job_batch_key then receive
+        bundles (see executors.bundle.JobBundle), which have no rule
+        attribute. If a bundle fails, only its jobs that have recorded a
+        successful exit in the executor's tmpdir are reported as successful,
+        which requires a shared filesystem for persistence. The job command
+        of a bundle is a shell script that has to be executed by a POSIX
+        shell.
+    max_bundled_job_runtime: float
+        Only jobs with a numeric runtime resource (in minutes) of at most this
+        value are bundled (see max_job_bundle_size), and the summed runtime of
+        a bundle does not exceed it either. Jobs without a runtime resource
+        are never bundled.
+    cancel_chunk_size: Optional[int]
+        If set, jobs are cancelled in chunks of this size, i.e. cancel_jobs is
+        called once per chunk.
+    max_concurrent_cancels: int
+        Maximum number of chunks that are cancelled concurrently (in
+        separate threads). cancel_jobs has to be thread-safe if this is
+        greater than one.
+    cancel_timeout: Optional[float]
+        Overall time limit (in seconds) for cancelling all jobs when the
+        workflow is cancelled. Jobs whose cancellation has not been confirmed
+        until then are listed in an error message, such that they can be
+        cancelled manually. None means no limit.
+    submission_journal: bool
+        Whether remote executors shall record submitted and finished jobs in a
+        journal under .snakemake/auxiliary/executor-journals. When the workflow
+        is restarted (e.g. after a crash of the main process), jobs that are
+        still running according to the journal are not submitted again.
+        Instead, they are added to the active jobs and checked via
+        check_active_jobs using their recorded external jobid and aux
+        information, which therefore has to be JSON serializable. Only enable
+        this if check_active_jobs can handle jobs submitted by a previous run.
+    max_concurrent_submissions: int
+        Maximum number of concurrent calls of run_job if the executor defines
+        run_job as a coroutine (async def). Such executors submit the jobs
+        passed to run_jobs concurrently on the event loop of the remote
+        executor.
+    max_status_check_staleness: Optional[float]
+        If set, active jobs are not checked in every status check cycle.
+        Instead, a job is checked again after a time proportional to the time
+        since its submission or its last state change (see
+        RemoteExecutor.report_job_status), but at least every
+        seconds_between_status_checks and at most every
+        max_status_check_staleness seconds. Young jobs are thereby checked
+        frequently, and long running jobs rarely.
+    envvar_declarations_file: bool
+        If pass_envvar_declarations_to_cmd is set, write the envvars once per
+        run into a file that is only readable by the user (in the executor's
+        tmpdir) and source it in the job command, instead of declaring them
+        inline. This keeps job commands short and the values of the envvars
+        (e.g. tokens) out of job listings of the cluster. Only has an effect
+        if the executor provides a directory for auxiliary files (e.g. remote
+        executors with a shared filesystem for persistence).
     """
 
     non_local_exec: bool
@@ -73,6 +171,22 @@ class CommonSettings:
     pass_group_args: bool = False
     spawned_jobs_assume_shared_fs: bool = False
     can_transfer_local_files: bool = False
+    status_check_chunk_size: Optional[int] = None
+    max_concurrent_status_checks: int = 1
+    job_exit_notifications: bool = False
+    adaptive_status_checks: bool = False
+    min_seconds_between_status_checks: float = 1
+    max_seconds_between_status_checks: float = 180
+    max_inline_job_args_size: Optional[int] = None
+    max_job_bundle_size: Optional[int] = None
+    max_bundled_job_runtime: float = 60
+    cancel_chunk_size: Optional[int] = None
+    max_concurrent_cancels: int = 1
+    cancel_timeout: Optional[float] = None
+    submission_journal: bool = False
+    max_concurrent_submissions: int = 10
+    max_status_check_staleness: Optional[float] = None
+    envvar_declarations_file: bool = False
 
     @property
     def local_exec(self):
@@ -0,0 +1,310 @@
+__author__ = "Johannes Köster"
+__copyright__ = "Copyright 2023, Johannes Köster"
+__email__ = "johannes.koester@uni-due.de"
+__license__ = "MIT"
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
+
+# Environment variable that, if set, makes executors record a trace of the
+# lifecycle of their jobs and write it to the given file on shutdown.
+# The file is written in the OTLP JSON format if its name ends with
+# ".otlp.json", and in the Chrome trace event format (to be opened e.g. with
+# chrome://tracing or https://ui.perfetto.dev) otherwise.
+trace_file_envvar = "SNAKEMAKE_EXECUTOR_TRACE_FILE"
+
+status_checks_track = "status checks"
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    # wall clock times in nanoseconds since the epoch
+    start_ns: int
+    end_ns: int
+    # e.g. "job 3" or "status checks"
+    track: str
+    attributes: Dict[str, Any]
+
+
+def _job_track(job: JobExecutorInterface) -> str:
+    return f"job {job.jobid}"
+
+
+def _job_attributes(job: JobExecutorInterface) -> Dict[str, Any]:
+    return {"jobid": job.jobid, "rule": job.name}
+
+
+def _write_atomic(path: str, content: str):
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".trace.")
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class TraceExporterBase(ABC):
+    @abstractmethod
+    def export(self, tracer: "ExecutorTracer") -> None: ...
+
+
+class ChromeTraceExporter(TraceExporterBase):
+    """Write spans in the Chrome trace event format, with one track (thread)
+    per job and one for the status checks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, tracer: "ExecutorTracer") -> None:
+        spans = tracer.get_spans()
+        tids: Dict[str, int] = {status_checks_track: 0}
+        events = []
+        for span in spans:
+            tid = tids.setdefault(span.track, len(tids))
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": (span.start_ns - tracer.origin_ns) / 1000,
+                    "dur": (span.end_ns - span.start_ns) / 1000,
+                    "pid": 1,
+                    "tid": tid,
+                    "args": span.attributes,
+                }
+            )
+        for track, tid in tids.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": track},
+                }
+            )
+        _write_atomic(self.path, json.dumps({"traceEvents": events}))
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)}
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": key, "value": _otlp_value(value)} for key, value in attributes.items()
+    ]
+
+
+class OTLPFileExporter(TraceExporterBase):
+    """Write spans in the OTLP JSON format (as e.g. written by the file
+    exporter of the OpenTelemetry collector).
+
+    All spans belong to a single trace. The spans of each job are children
+    of a span covering the whole lifecycle of the job.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, tracer: "ExecutorTracer") -> None:
+        trace_id = os.urandom(16).hex()
+        # track -> (span id, start, end)
+        roots: Dict[str, Tuple[str, int, int]] = dict()
+        spans = []
+        for span in tracer.get_spans():
+            parent_span_id = ""
+            if span.track != status_checks_track:
+                root = roots.get(span.track)
+                if root is None:
+                    root = (os.urandom(8).hex(), span.start_ns, span.end_ns)
+                else:
+                    root = (
+                        root[0],
+                        min(root[1], span.start_ns),
+                        max(root[2], span.end_ns),
+                    )
+                roots[span.track] = root
+                parent_span_id = root[0]
+            spans.append(
+                {
+                    "traceId": trace_id,
+                    "spanId": os.urandom(8).hex(),
+                    "parentSpanId": parent_span_id,
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": _otlp_attributes(span.attributes),
+                }
+            )
+        for track, (span_id, start_ns, end_ns) in roots.items():
+            spans.append(
+                {
+                    "traceId": trace_id,
+                    "spanId": span_id,
+                    "parentSpanId": "",
+                    "name": track,
+                    "kind": 1,
+                    "startTimeUnixNano": str(start_ns),
+                    "endTimeUnixNano": str(end_ns),
+                    "attributes": [],
+                }
+            )
+        content = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _otlp_attributes(
+                            {"service.name": "snakemake-executor"}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "snakemake_interface_executor_plugins"},
+                            "spans": spans,
+                        }
+                    ],
+                }
+            ]
+        }
+        _write_atomic(self.path, json.dumps(content))
+
+
+class ExecutorTracer:
+    """Spans of the lifecycle of the jobs of an executor (building the job
+    command, writing the jobscript, submission, and the states of the job
+    after submission, e.g. queued and running) and of its status checks.
+
+    Nothing is recorded unless an exporter is registered (e.g. via
+    SNAKEMAKE_EXECUTOR_TRACE_FILE).
+    """
+
+    def __init__(self):
+        self.origin_ns = time.time_ns()
+        self._spans: List[Span] = []
+        # jobid -> (state, start, attributes) of the current state of
+        # submitted jobs
+        self._job_states: Dict[int, Tuple[str, int, Dict[str, Any]]] = dict()
+        self._lock = threading.Lock()
+        self.exporters: List[TraceExporterBase] = []
+        path = os.environ.get(trace_file_envvar)
+        if path:
+            if path.endswith(".otlp.json"):
+                self.exporters.append(OTLPFileExporter(path))
+            else:
+                self.exporters.append(ChromeTraceExporter(path))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def add_span(
+        self,
+        name: str,
+        start_ns: int,
+        track: str,
+        end_ns: Optional[int] = None,
+        **attributes,
+    ):
+        """Record a span that ends now (or at end_ns)."""
+        if not self.enabled:
+            return
+        if end_ns is None:
+            end_ns = time.time_ns()
+        span = Span(name, start_ns, end_ns, track, attributes)
+        with self._lock:
+            self._spans.append(span)
+
+    def add_job_span(
+        self, job: JobExecutorInterface, name: str, start_ns: int, **attributes
+    ):
+        """Record a span of the given job that ends now."""
+        if not self.enabled:
+            return
+        self.add_span(
+            name, start_ns, _job_track(job), **_job_attributes(job), **attributes
+        )
+
+    @contextmanager
+    def job_span(self, job: JobExecutorInterface, name: str) -> Iterator[None]:
+        start_ns = time.time_ns()
+        try:
+            yield
+        finally:
+            self.add_job_span(job, name, start_ns)
+
+    def set_job_state(
+        self, job: JobExecutorInterface, state: Optional[str], **attributes
+    ):
+        """Record that the given submitted job has entered the given state
+        (e.g. "submitted", or a state reported by the cluster like "PENDING").
+
+        This ends the span of the previous state of the job. A state of None
+        means that the job has finished. The given attributes are added to
+        the span of the new state, or, if the job has finished, to the span
+        of its last state.
+        """
+        if not self.enabled:
+            return
+        now = time.time_ns()
+        with self._lock:
+            previous = self._job_states.pop(job.jobid, None)
+            if previous is not None and previous[0] == state:
+                # no state change
+                self._job_states[job.jobid] = previous
+                return
+            if state is not None:
+                self._job_states[job.jobid] = (state, now, attributes)
+        if previous is not None:
+            previous_state, start_ns, previous_attributes = previous
+            if state is None:
+                previous_attributes = {**previous_attributes, **attributes}
+            self.add_span(
+                previous_state,
+                start_ns,
+                _job_track(job),
+                end_ns=now,
+                **_job_attributes(job),
+                **previous_attributes,
+            )
+
+    def get_spans(self) -> List[Span]:
+        """Return the recorded spans, including the current states of jobs
+        that have not finished yet.
+        """
+        now = time.time_ns()
+        with self._lock:
+            spans = list(self._spans)
+            for jobid, (state, start_ns, attributes) in self._job_states.items():
+                spans.append(
+                    Span(
+                        state,
+                        start_ns,
+                        now,
+                        f"job {jobid}",
+                        {"jobid": jobid, "unfinished": True, **attributes},
+                    )
+                )
+        spans.sort(key=lambda span: span.start_ns)
+        return spans
+
+    def export(self):
+        for exporter in self.exporters:
+            exporter.export(self)
@@ -9,12 +9,15 @@ from collections import UserDict
 from pathlib import Path
 import re
 import shlex
+import string
 import threading
-from typing import Any, List
+from typing import Any, List, Optional, Tuple
 from urllib.parse import urlparse
 from collections import namedtuple
 import concurrent.futures
 import contextlib
+import functools
+import warnings
 
 from snakemake_interface_common.settings import SettingsEnumBase
 from snakemake_interface_common.utils import not_iterable
@@ -56,7 +59,16 @@ def format_cli_value(
 
     If base64_encode is True, str values are encoded and flagged as being base64 encoded.
     """
+    if isinstance(value, (str, Path)):
+        # Values like rule names, paths or resource definitions recur across
+        # many jobs, hence their formatting is cached.
+        return _format_cli_value_cached(value, quote, base64_encode)
+    return _format_cli_value(value, quote=quote, base64_encode=base64_encode)
 
+
+def _format_cli_value(
+    value: Any, quote: bool = False, base64_encode: bool = False
+) -> str:
     def maybe_encode(value):
         return encode_as_base64(value) if base64_encode else value
 
@@ -79,6 +91,12 @@ def format_cli_value(
         return repr(value)
 
 
+# typed=True ensures that e.g. str subclasses are cached separately
+_format_cli_value_cached = functools.lru_cache(maxsize=4096, typed=True)(
+    _format_cli_value
+)
+
+
 def join_cli_args(args):
     try:
         return " ".join(arg for arg in args if arg)
@@ -116,6 +134,39 @@ def encode_target_jobs_cli_args(
     return items
 
 
+class CompiledTemplate:
+    """A str.format template that is parsed once and then rendered by
+    concatenation.
+
+    Templates using format specs, conversions or compound field names
+    (e.g. {properties[rule]}) are rendered via str.format.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts: Optional[List[Tuple[str, Optional[str]]]]
+        parts = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(
+            template
+        ):
+            if field_name is not None and (
+                format_spec or conversion or not field_name.isidentifier()
+            ):
+                self._parts = None
+                break
+            parts.append((literal, field_name))
+        else:
+            self._parts = parts
+
+    def format(self, **values: Any) -> str:
+        if self._parts is None:
+            return self.template.format(**values)
+        return "".join(
+            literal if field_name is None else f"{literal}{values[field_name]}"
+            for literal, field_name in self._parts
+        )
+
+
 _pool = concurrent.futures.ThreadPoolExecutor()
 
 
@@ -126,7 +177,15 @@ async def async_lock(_lock: threading.Lock):
     Necessary because asycio.Lock is not threadsafe, so only one thread can safely use
     it at a time.
     Source: https://stackoverflow.com/a/63425191
+
+    Deprecated: remote executors do not use a lock anymore, jobs are handed
+    over to the status checks via a thread-safe deque.
     """
+    warnings.warn(
+        "async_lock is deprecated and will be removed in a future release.",
+        DeprecationWarning,
+        stacklevel=2,
+    )
     loop = asyncio.get_event_loop()
     await loop.run_in_executor(_pool, _lock.acquire)
     try:
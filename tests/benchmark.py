@@ -0,0 +1,243 @@
+"""Offline benchmarks for the hot paths of the executor base classes.
+
+Run with
+
+    python tests/benchmark.py [--output results.json] [--quick]
+        [--compare baseline.json] [--tolerance 0.25]
+
+The results are printed (or written) as JSON, such that they can be compared
+between releases. With --compare, they are compared with the results of a
+previous run, and the script fails if a benchmark got slower per item by more
+than the given tolerance (a fraction of the baseline).
+"""
+
+import argparse
+import asyncio
+from importlib.metadata import PackageNotFoundError, version
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from snakemake_interface_executor_plugins.executors.base import SubmittedJobInfo
+from stubs import make_executor, make_jobs
+
+
+def measure(
+    func: Callable[[Any], Any],
+    setup: Callable[[], Any],
+    n: int,
+    repeat: int,
+) -> Dict[str, float]:
+    """Run func repeat times on a fresh setup and report the best run,
+    normalized by n items.
+    """
+    timings = []
+    for _ in range(repeat):
+        context = setup()
+        start = time.perf_counter()
+        func(context)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "n": n,
+        "seconds": best,
+        "items_per_second": n / best if best else float("inf"),
+        "microseconds_per_item": best / n * 1e6,
+    }
+
+
+def setup_executor(**kwargs):
+    executor = make_executor(**kwargs)
+    # Stop the wait thread, such that it does not interfere with the
+    # measurements. The benchmarks drive the polling directly.
+    executor.wait = False
+    executor.wait_future.result()
+    return executor
+
+
+def bench_run_jobs(n: int, repeat: int) -> Dict[str, float]:
+    def setup():
+        return setup_executor(), make_jobs(n)
+
+    def run(context):
+        executor, jobs = context
+        executor.run_jobs(jobs)
+
+    return measure(run, setup, n, repeat)
+
+
+def bench_write_jobscript(n: int, repeat: int) -> Dict[str, float]:
+    def setup():
+        return setup_executor(), make_jobs(n)
+
+    def run(context):
+        executor, jobs = context
+        for job in jobs:
+            executor.write_jobscript(job, executor.get_jobscript(job))
+
+    return measure(run, setup, n, repeat)
+
+
+def bench_format_job_exec(n: int, repeat: int) -> Dict[str, float]:
+    def setup():
+        return setup_executor(), make_jobs(n, n_input=10)
+
+    def run(context):
+        executor, jobs = context
+        for job in jobs:
+            executor.format_job_exec(job)
+
+    return measure(run, setup, n, repeat)
+
+
+def bench_get_resource_declarations(n: int, repeat: int) -> Dict[str, float]:
+    def setup():
+        return setup_executor(), make_jobs(n)
+
+    def run(context):
+        executor, jobs = context
+        for job in jobs:
+            executor.get_resource_declarations(job)
+
+    return measure(run, setup, n, repeat)
+
+
+def bench_poll_cycle(n: int, repeat: int) -> Dict[str, float]:
+    """Measure the overhead of a status check cycle over n active jobs.
+
+    The stub plugin does no work in check_active_jobs, hence this
+    measures the base class only.
+    """
+
+    def setup():
+        executor = setup_executor()
+        for job in make_jobs(n):
+            executor.report_job_submission(
+                SubmittedJobInfo(job, external_jobid=str(job.jobid)),
+                register_job=False,
+            )
+        # the first cycle takes over the submitted jobs
+        asyncio.run(executor._poll_active_jobs())
+        return executor
+
+    def run(executor):
+        asyncio.run(executor._poll_active_jobs())
+
+    return measure(run, setup, n, repeat)
+
+
+def compare_results(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Return a description of each benchmark that is slower per item than
+    in the baseline by more than the given tolerance.
+    """
+    baseline_timings = {
+        (result["name"], result["n"]): result["microseconds_per_item"]
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        before = baseline_timings.get((result["name"], result["n"]))
+        if before is None:
+            continue
+        after = result["microseconds_per_item"]
+        if after > before * (1 + tolerance):
+            regressions.append(
+                f"{result['name']} (n={result['n']}): "
+                f"{before:.2f} -> {after:.2f} µs/item"
+            )
+    return regressions
+
+
+def package_version() -> str:
+    try:
+        return version("snakemake-interface-executor-plugins")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="Write JSON results to this file.")
+    parser.add_argument(
+        "--quick", action="store_true", help="Use small sizes (e.g. for CI)."
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="BASELINE",
+        help="Compare with the JSON results of a previous run and exit with a "
+        "non-zero status if a benchmark got slower.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown per item relative to the baseline "
+        "(default: %(default)s).",
+    )
+    args = parser.parse_args()
+
+    scale = 10 if args.quick else 1
+    repeat = 3
+    benchmarks = [
+        ("run_jobs", bench_run_jobs, [10000 // scale]),
+        ("write_jobscript", bench_write_jobscript, [2000 // scale]),
+        ("format_job_exec", bench_format_job_exec, [10000 // scale]),
+        ("get_resource_declarations", bench_get_resource_declarations, [10000]),
+        (
+            "poll_cycle",
+            bench_poll_cycle,
+            [1000, 10000] if args.quick else [1000, 10000, 100000],
+        ),
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name, bench, sizes in benchmarks:
+                for n in sizes:
+                    result = bench(n, repeat)
+                    results.append({"name": name, **result})
+                    print(
+                        f"{name} (n={n}): "
+                        f"{result['microseconds_per_item']:.2f} µs/item",
+                        file=sys.stderr,
+                    )
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "package_version": package_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(
+                f"Slower than {args.compare} by more than "
+                f"{args.tolerance:.0%}:\n" + "\n".join(regressions),
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
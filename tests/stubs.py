@@ -0,0 +1,425 @@
+"""In-memory implementations of the executor interfaces.
+
+They allow to instantiate and drive the executor base classes without
+Snakemake, e.g. in tests and benchmarks.
+"""
+
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set
+
+from snakemake_interface_executor_plugins.cli import (
+    SpawnedJobArgsFactoryExecutorInterface,
+)
+from snakemake_interface_executor_plugins.dag import DAGExecutorInterface
+from snakemake_interface_executor_plugins.executors.base import SubmittedJobInfo
+from snakemake_interface_executor_plugins.executors.remote import RemoteExecutor
+from snakemake_interface_executor_plugins.jobs import JobExecutorInterface
+from snakemake_interface_executor_plugins.logging import LoggerExecutorInterface
+from snakemake_interface_executor_plugins.persistence import (
+    PersistenceExecutorInterface,
+)
+from snakemake_interface_executor_plugins.registry.plugin import Plugin
+from snakemake_interface_executor_plugins.scheduler import (
+    JobSchedulerExecutorInterface,
+)
+from snakemake_interface_executor_plugins.settings import (
+    CommonSettings,
+    DeploymentSettingsExecutorInterface,
+    ExecutionSettingsExecutorInterface,
+    GroupSettingsExecutorInterface,
+    RemoteExecutionSettingsExecutorInterface,
+    SharedFSUsage,
+    StorageSettingsExecutorInterface,
+)
+from snakemake_interface_executor_plugins.utils import TargetSpec
+from snakemake_interface_executor_plugins.workflow import WorkflowExecutorInterface
+
+
+class StubJob(JobExecutorInterface):
+    def __init__(
+        self,
+        jobid: int,
+        rule: str = "a",
+        attempt: int = 1,
+        resources: Optional[Mapping[str, Any]] = None,
+        n_input: int = 1,
+    ):
+        self._jobid = jobid
+        self._rule = rule
+        self._attempt = attempt
+        self._resources = resources or {
+            "_cores": 1,
+            "_nodes": 1,
+            "mem_mb": 1000,
+            "disk_mb": 1000,
+            "runtime": 60,
+            "tmpdir": "/tmp",
+        }
+        self._input = [f"data/{rule}/{jobid}/{i}.txt" for i in range(n_input)]
+        self.external_jobid: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self._rule
+
+    @property
+    def jobid(self) -> int:
+        return self._jobid
+
+    def logfile_suggestion(self, prefix: str) -> str:
+        return f"{prefix}/{self._rule}/{self._jobid}.log"
+
+    def is_group(self) -> bool:
+        return False
+
+    def log_info(self, skip_dynamic: bool = False) -> None:
+        pass
+
+    def log_error(self, msg: Optional[str] = None, **kwargs) -> None:
+        pass
+
+    def properties(
+        self, omit_resources: Sequence[str] = ("_cores", "_nodes"), **aux_properties
+    ) -> Mapping[str, Any]:
+        return {
+            "type": "single",
+            "rule": self._rule,
+            "jobid": self._jobid,
+            "resources": {
+                name: value
+                for name, value in self._resources.items()
+                if name not in omit_resources
+            },
+            **aux_properties,
+        }
+
+    @property
+    def resources(self) -> Mapping[str, Any]:
+        return self._resources
+
+    @property
+    def is_local(self) -> bool:
+        return False
+
+    @property
+    def is_updated(self) -> bool:
+        return False
+
+    @property
+    def output(self) -> Iterable[str]:
+        return [f"results/{self._rule}/{self._jobid}.txt"]
+
+    def register(self, external_jobid: Optional[str] = None) -> None:
+        self.external_jobid = external_jobid
+
+    def get_target_spec(self) -> List[TargetSpec]:
+        return [TargetSpec(self._rule, {"sample": f"s{self._jobid}"})]
+
+    @property
+    def rules(self) -> List[str]:
+        return [self._rule]
+
+    @property
+    def attempt(self) -> int:
+        return self._attempt
+
+    @property
+    def input(self) -> Iterable[str]:
+        return self._input
+
+    @property
+    def threads(self) -> int:
+        return 1
+
+    @property
+    def log(self) -> Iterable[str]:
+        return []
+
+    def get_wait_for_files(self) -> Iterable[str]:
+        return self._input
+
+    def format_wildcards(self, string, **variables) -> str:
+        _variables = dict(jobid=self._jobid, rule=self._rule, name=self._rule)
+        _variables.update(variables)
+        return string.format(**_variables)
+
+    @property
+    def is_containerized(self) -> bool:
+        return False
+
+
+class StubLogger(LoggerExecutorInterface):
+    def __init__(self):
+        self.messages: List[str] = []
+
+    def info(self, msg: str) -> None:
+        self.messages.append(msg)
+
+    def error(self, msg: str) -> None:
+        self.messages.append(msg)
+
+    def debug(self, msg: str) -> None:
+        pass
+
+
+class StubDAG(DAGExecutorInterface):
+    def __init__(self, sources: Iterable[str] = ()):
+        self.sources = list(sources)
+
+    def incomplete_external_jobid(self, job: JobExecutorInterface) -> Optional[str]:
+        return None
+
+    def get_sources(self) -> Iterable[str]:
+        return self.sources
+
+    def get_unneeded_temp_files(self, job: JobExecutorInterface) -> Iterable[str]:
+        return []
+
+
+class StubSpawnedJobArgsFactory(SpawnedJobArgsFactoryExecutorInterface):
+    def general_args(self, executor_common_settings: CommonSettings) -> str:
+        return (
+            "--force --target-files-omit-workdir-adjustment "
+            "--keep-storage-local-copies "
+            "--max-inventory-time 0 --nocolor --notemp --no-hooks --nolock "
+            "--ignore-incomplete --rerun-triggers mtime params code software-env "
+            "input --conda-frontend conda --shared-fs-usage persistence "
+            "input-output software-deployment sources source-cache "
+            "--wrapper-prefix https://github.com/snakemake/snakemake-wrappers/raw/ "
+            "--latency-wait 5 --scheduler ilp --local-storage-prefix "
+            ".snakemake/storage --scheduler-solver-path /usr/bin "
+            "--default-resources 'mem_mb=min(max(2*input.size_mb, 1000), 8000)' "
+            "'disk_mb=max(2*input.size_mb, 1000) if input else 50000' "
+            "'tmpdir=system_tmpdir'"
+        )
+
+    def precommand(self, executor_common_settings: CommonSettings) -> str:
+        return ""
+
+    def envvars(self) -> Mapping[str, str]:
+        return {"SNAKEMAKE_TEST_TOKEN": "secret"}
+
+
+class StubScheduler(JobSchedulerExecutorInterface):
+    def __init__(self):
+        self.submitted: List[JobExecutorInterface] = []
+        self.finished: List[JobExecutorInterface] = []
+        self.failed: List[JobExecutorInterface] = []
+        self.errors: List[Exception] = []
+
+    def executor_error_callback(self, exception: Exception) -> None:
+        self.errors.append(exception)
+
+    def submit_callback(self, job: JobExecutorInterface) -> None:
+        self.submitted.append(job)
+
+    def finish_callback(self, job: JobExecutorInterface) -> None:
+        self.finished.append(job)
+
+    def error_callback(self, job: JobExecutorInterface) -> None:
+        self.failed.append(job)
+
+
+class StubRemoteExecutionSettings(RemoteExecutionSettingsExecutorInterface):
+    def __init__(self, seconds_between_status_checks: float = 0.01):
+        self._seconds_between_status_checks = seconds_between_status_checks
+
+    @property
+    def jobname(self) -> str:
+        return "snakejob.{name}.{jobid}.sh"
+
+    @property
+    def jobscript(self) -> Optional[str]:
+        return None
+
+    @property
+    def immediate_submit(self) -> bool:
+        return False
+
+    @property
+    def envvars(self) -> Sequence[str]:
+        return []
+
+    @property
+    def max_status_checks_per_second(self) -> float:
+        return 1000
+
+    @property
+    def seconds_between_status_checks(self) -> float:
+        return self._seconds_between_status_checks
+
+
+class StubExecutionSettings(ExecutionSettingsExecutorInterface):
+    @property
+    def keep_incomplete(self) -> bool:
+        return False
+
+
+class StubStorageSettings(StorageSettingsExecutorInterface):
+    def __init__(self, shared_fs_usage: Optional[Set[SharedFSUsage]] = None):
+        self._shared_fs_usage = (
+            set(SharedFSUsage.all()) if shared_fs_usage is None else shared_fs_usage
+        )
+
+    @property
+    def shared_fs_usage(self) -> Set[SharedFSUsage]:
+        return self._shared_fs_usage
+
+
+class StubDeploymentSettings(DeploymentSettingsExecutorInterface):
+    @property
+    def deployment_methods(self) -> Set[str]:
+        return set()
+
+
+class StubGroupSettings(GroupSettingsExecutorInterface):
+    @property
+    def local_groupid(self) -> str:
+        return "local"
+
+
+class StubPersistence(PersistenceExecutorInterface):
+    @property
+    def path(self) -> Path:
+        return Path(".snakemake")
+
+    @property
+    def aux_path(self) -> Path:
+        return Path(".snakemake/auxiliary")
+
+
+class StubResourceScopes:
+    excluded: Set[str] = {"tmpdir"}
+
+
+class StubResourceSettings:
+    cores = sys.maxsize
+
+
+class StubWorkflow(WorkflowExecutorInterface):
+    def __init__(
+        self,
+        executor_cls: type,
+        common_settings: Optional[CommonSettings] = None,
+        shared_fs_usage: Optional[Set[SharedFSUsage]] = None,
+        seconds_between_status_checks: float = 0.01,
+    ):
+        if common_settings is None:
+            common_settings = make_common_settings()
+        self._executor_plugin = Plugin(
+            executor=executor_cls,
+            common_settings=common_settings,
+            _executor_settings_cls=None,
+            _name="stub",
+        )
+        self._remote_execution_settings = StubRemoteExecutionSettings(
+            seconds_between_status_checks
+        )
+        self._storage_settings = StubStorageSettings(shared_fs_usage)
+        self._scheduler = StubScheduler()
+        self.dag = StubDAG()
+        self.executor_settings = None
+        self.resource_settings = StubResourceSettings()
+        os.makedirs(self.persistence.aux_path, exist_ok=True)
+
+    @property
+    def spawned_job_args_factory(self) -> SpawnedJobArgsFactoryExecutorInterface:
+        return StubSpawnedJobArgsFactory()
+
+    @property
+    def execution_settings(self) -> ExecutionSettingsExecutorInterface:
+        return StubExecutionSettings()
+
+    @property
+    def remote_execution_settings(self) -> RemoteExecutionSettingsExecutorInterface:
+        return self._remote_execution_settings
+
+    @property
+    def storage_settings(self) -> StorageSettingsExecutorInterface:
+        return self._storage_settings
+
+    @property
+    def deployment_settings(self) -> DeploymentSettingsExecutorInterface:
+        return StubDeploymentSettings()
+
+    @property
+    def group_settings(self) -> GroupSettingsExecutorInterface:
+        return StubGroupSettings()
+
+    @property
+    def executor_plugin(self) -> Optional[Plugin]:
+        return self._executor_plugin
+
+    @property
+    def resource_scopes(self):
+        return StubResourceScopes()
+
+    @property
+    def main_snakefile(self):
+        return os.path.abspath("Snakefile")
+
+    @property
+    def persistence(self) -> PersistenceExecutorInterface:
+        return StubPersistence()
+
+    @property
+    def workdir_init(self):
+        return os.getcwd()
+
+    @property
+    def scheduler(self) -> StubScheduler:
+        return self._scheduler
+
+
+class StubRemoteExecutor(RemoteExecutor):
+    """Remote executor that submits nothing.
+
+    Jobs stay active until they are listed in self.finished_jobids.
+    """
+
+    def __post_init__(self):
+        self.finished_jobids: Set[int] = set()
+        self.cancelled: List[SubmittedJobInfo] = []
+
+    def run_job(self, job: JobExecutorInterface):
+        self.format_job_exec(job)
+        self.report_job_submission(
+            SubmittedJobInfo(job, external_jobid=str(job.jobid)),
+            register_job=False,
+        )
+
+    async def check_active_jobs(self, active_jobs: List[SubmittedJobInfo]):
+        for job_info in active_jobs:
+            if job_info.job.jobid in self.finished_jobids:
+                self.report_job_success(job_info)
+            else:
+                yield job_info
+
+    def cancel_jobs(self, active_jobs: List[SubmittedJobInfo]):
+        self.cancelled.extend(active_jobs)
+
+
+def make_common_settings(**kwargs: Any) -> CommonSettings:
+    """Common settings of a remote executor with a shared filesystem, with the
+    given fields overridden.
+    """
+    settings: Dict[str, Any] = dict(
+        non_local_exec=True,
+        implies_no_shared_fs=False,
+        job_deploy_sources=False,
+    )
+    settings.update(kwargs)
+    return CommonSettings(**settings)
+
+
+def make_executor(
+    executor_cls: type = StubRemoteExecutor, **kwargs: Any
+) -> RemoteExecutor:
+    workflow = StubWorkflow(executor_cls, **kwargs)
+    return executor_cls(workflow, StubLogger())
+
+
+def make_jobs(n: int, **kwargs: Any) -> List[StubJob]:
+    return [StubJob(jobid, **kwargs) for jobid in range(n)]
@@ -1,9 +1,76 @@
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
 from typing import List
+
+import pytest
 from snakemake_interface_executor_plugins.registry import ExecutorPluginRegistry
 from snakemake_interface_common.plugin_registry.tests import TestRegistryBase
 from snakemake_interface_common.plugin_registry.plugin import PluginBase, SettingsBase
 from snakemake_interface_common.plugin_registry import PluginRegistryBase
-from snakemake_interface_executor_plugins.utils import format_cli_arg
+from snakemake_interface_common.exceptions import WorkflowError
+from pathlib import Path
+from snakemake_interface_executor_plugins.commands import (
+    AsyncCommandRunner,
+    CommandError,
+)
+from snakemake_interface_executor_plugins.eventloop import get_event_loop_service
+from snakemake_interface_executor_plugins.executors.base import (
+    ActiveJobStore,
+    SubmittedJobInfo,
+)
+from snakemake_interface_executor_plugins.executors.bundle import JobBundle, bundle_jobs
+from snakemake_interface_executor_plugins.executors.journal import (
+    SubmissionJournal,
+    job_output_digest,
+)
+from snakemake_interface_executor_plugins.executors.sources import (
+    build_source_archive,
+    format_source_archive_extract_cmd,
+)
+from snakemake_interface_executor_plugins.metrics import PrometheusTextfileExporter
+from snakemake_interface_executor_plugins.settings import SharedFSUsage
+from snakemake_interface_executor_plugins.tracing import trace_file_envvar
+from snakemake_interface_executor_plugins.utils import (
+    CompiledTemplate,
+    async_lock,
+    format_cli_arg,
+    format_cli_value,
+)
+
+from stubs import (
+    StubJob,
+    StubRemoteExecutor,
+    make_common_settings,
+    make_executor,
+    make_jobs,
+)
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout, "timeout"
+        time.sleep(0.01)
+
+
+def stop_status_checks(executor):
+    """Stop the background status checks, such that the test can perform
+    them via poll_once.
+    """
+    executor.wait = False
+    executor.event_loop_service.loop.call_soon_threadsafe(executor._wakeup.set)
+    executor.wait_future.result()
+
+
+def poll_once(executor):
+    asyncio.run(executor._poll_active_jobs())
 
 
 class TestRegistry(TestRegistryBase):
@@ -54,3 +121,1068 @@ def test_format_cli_arg_expr():
 def test_format_cli_arg_list():
     fmt = format_cli_arg("--config", ["foo={'bar': 1}"])
     assert fmt == "--config \"foo={'bar': 1}\""
+
+
+def test_compiled_template():
+    template = "#!/bin/sh\n# properties = {properties}\n{exec_job}\n{{literal}}\n"
+    values = dict(properties={"rule": "a"}, exec_job="python -m snakemake")
+    assert CompiledTemplate(template).format(**values) == template.format(**values)
+
+
+def test_compiled_template_fallback():
+    template = "{properties[rule]} {exec_job!r}"
+    values = dict(properties={"rule": "a"}, exec_job="cmd")
+    assert CompiledTemplate(template).format(**values) == "a 'cmd'"
+
+
+def test_format_cli_value_cached():
+    for value, kwargs, expected in [
+        ("a b", dict(quote=True), "'a b'"),
+        ("a b", dict(), "a b"),
+        ("'a b'", dict(quote=True), "'a b'"),
+        ("a", dict(base64_encode=True), "base64//YQ=="),
+        (Path("a b"), dict(), "'a b'"),
+    ]:
+        # the second call is served from the cache
+        for _ in range(2):
+            assert format_cli_value(value, **kwargs) == expected
+
+
+class ChunkRecordingExecutor(StubRemoteExecutor):
+    """Records the chunks passed to check_active_jobs. Jobs in
+    dropped_jobids are neither reported nor yielded, a chunk containing a job
+    in failing_jobids raises an error.
+    """
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.chunks = []
+        self.dropped_jobids = set()
+        self.failing_jobids = set()
+
+    async def check_active_jobs(self, active_jobs):
+        jobids = [job_info.job.jobid for job_info in active_jobs]
+        self.chunks.append(jobids)
+        if self.failing_jobids:
+            if self.failing_jobids.intersection(jobids):
+                raise IOError("chunk failed")
+            # report after the failing chunk has raised its error
+            await asyncio.sleep(0.05)
+        for job_info in active_jobs:
+            if job_info.job.jobid in self.dropped_jobids:
+                continue
+            if job_info.job.jobid in self.finished_jobids:
+                self.report_job_success(job_info)
+            else:
+                yield job_info
+
+
+def make_chunked_executor():
+    common_settings = make_common_settings(
+        status_check_chunk_size=2,
+        max_concurrent_status_checks=2,
+        # no status check before stop_status_checks
+        init_seconds_before_status_checks=60,
+    )
+    executor = make_executor(ChunkRecordingExecutor, common_settings=common_settings)
+    stop_status_checks(executor)
+    return executor
+
+
+def test_chunked_status_checks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_chunked_executor()
+    executor.run_jobs(make_jobs(5))
+    poll_once(executor)
+    assert sorted(executor.chunks) == [[0, 1], [2, 3], [4]]
+    # yielded jobs are checked again in the next cycle
+    executor.finished_jobids.add(2)
+    poll_once(executor)
+    executor.chunks = []
+    poll_once(executor)
+    assert sorted(executor.chunks) == [[0, 1], [3, 4]]
+    assert [job.jobid for job in executor.workflow.scheduler.finished] == [2]
+    assert len(executor.active_job_store) == 4
+    executor.shutdown()
+
+
+def test_chunked_status_checks_dropped_jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_chunked_executor()
+    executor.run_jobs(make_jobs(4))
+    executor.dropped_jobids.add(1)
+    poll_once(executor)
+    # a job that is neither yielded nor reported is no longer checked
+    assert sorted(job_info.job.jobid for job_info in executor.active_jobs) == [
+        0,
+        2,
+        3,
+    ]
+    assert executor.active_job_store.get_by_jobid(1) is None
+    executor.shutdown()
+
+
+def test_chunked_status_checks_failing_chunk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_chunked_executor()
+    executor.run_jobs(make_jobs(4))
+    executor.finished_jobids.add(0)
+    executor.failing_jobids.add(3)
+    with pytest.raises(IOError):
+        poll_once(executor)
+    # the job reported by the other chunk is gone, all others are kept
+    assert [job.jobid for job in executor.workflow.scheduler.finished] == [0]
+    assert sorted(job_info.job.jobid for job_info in executor.active_jobs) == [
+        1,
+        2,
+        3,
+    ]
+    executor.failing_jobids.clear()
+    executor.finished_jobids.update({1, 2, 3})
+    poll_once(executor)
+    assert sorted(job.jobid for job in executor.workflow.scheduler.finished) == [
+        0,
+        1,
+        2,
+        3,
+    ]
+    assert not executor.active_jobs
+    executor.shutdown()
+
+
+class NotifiedExecutor(StubRemoteExecutor):
+    job_exit_notification_check_seconds = 0.01
+
+
+def test_job_exit_notifications(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        job_exit_notifications=True,
+    )
+    executor = make_executor(NotifiedExecutor, common_settings=common_settings)
+    scan = executor._scan_job_exit_notifications
+    failures = []
+
+    def scan_failing_once(finished):
+        if not failures:
+            failures.append(True)
+            raise OSError("unavailable")
+        return scan(finished)
+
+    executor._scan_job_exit_notifications = scan_failing_once
+    jobs = make_jobs(4)
+    executor.run_jobs(jobs)
+    wait_for(lambda: len(executor.active_job_store) == 4)
+    assert executor.get_job_exit_notification_cmd(jobs[0])
+    dirname = Path(executor.job_exit_notification_dir)
+
+    def notify(job, content):
+        # like the job exit notification command, write it atomically
+        path = dirname / executor._job_exit_notification_name(job)
+        tmp = path.with_name(f"{path.name}.tmp")
+        tmp.write_text(content)
+        tmp.rename(path)
+
+    notify(jobs[0], "0\n")
+    notify(jobs[1], "1\n")
+    notify(jobs[2], "garbage")
+    scheduler = executor.workflow.scheduler
+    wait_for(lambda: scheduler.finished == [jobs[0]] and scheduler.failed == [jobs[1]])
+    # the watcher has survived its first error
+    assert any("unavailable" in msg for msg in executor.logger.messages)
+    # the invalid notification is left to polling
+    wait_for(lambda: not os.listdir(dirname))
+    assert executor.active_job_store.get_by_jobid(2) is not None
+    executor.finished_jobids.add(2)
+    wait_for(lambda: len(scheduler.finished) == 2)
+    # the notification of a job that polling has reported is removed
+    executor.finished_jobids.add(3)
+    wait_for(lambda: len(scheduler.finished) == 3)
+    notify(jobs[3], "0\n")
+    wait_for(lambda: not os.listdir(dirname))
+    assert len(scheduler.finished) == 3 and len(scheduler.failed) == 1
+    assert not scheduler.errors
+    executor.shutdown()
+
+
+def test_job_exit_notification_in_jobscript(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        job_exit_notifications=True,
+    )
+    executor = make_executor(common_settings=common_settings)
+    # the notification watcher must not pick up the notification
+    stop_status_checks(executor)
+    # plugins that format the jobscript template themselves keep working
+    executor.jobscript.format(properties="{}", exec_job="true")
+    job = make_jobs(1)[0]
+    jobscript = executor.format_jobscript(job).replace(
+        executor.format_job_exec(job), "sh -c 'exit 3'"
+    )
+    status = subprocess.run(["sh", "-c", jobscript]).returncode
+    assert status == 3
+    path = Path(executor.job_exit_notification_dir) / (
+        executor._job_exit_notification_name(job)
+    )
+    assert path.read_text() == "3\n"
+    executor.shutdown()
+
+
+def test_adaptive_status_checks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        job_exit_notifications=True,
+        adaptive_status_checks=True,
+        # no status check before stop_status_checks
+        init_seconds_before_status_checks=60,
+        min_seconds_between_status_checks=0.5,
+        max_seconds_between_status_checks=4,
+    )
+    executor = make_executor(
+        common_settings=common_settings, seconds_between_status_checks=1
+    )
+    stop_status_checks(executor)
+
+    def interval_after_poll():
+        poll_once(executor)
+        return executor.next_seconds_between_status_checks
+
+    # idle checks back off
+    assert interval_after_poll() == 1.5
+    assert interval_after_poll() == 2.25
+    # submissions and finished jobs tighten the interval
+    jobs = make_jobs(3)
+    executor.run_jobs(jobs)
+    assert interval_after_poll() == 1.5
+    assert interval_after_poll() == 2.25
+    executor.finished_jobids.add(0)
+    assert interval_after_poll() == 1.5
+    # jobs reported via their exit notification do not count
+    path = os.path.join(
+        executor.job_exit_notification_dir,
+        executor._job_exit_notification_name(jobs[1]),
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("0\n")
+    asyncio.run(executor._process_job_exit_notifications())
+    assert len(executor.workflow.scheduler.finished) == 2
+    assert interval_after_poll() == 2.25
+    # the interval stays within the bounds
+    for _ in range(5):
+        interval_after_poll()
+    assert executor.next_seconds_between_status_checks == 4
+    for jobid in range(3, 10):
+        executor.run_jobs([StubJob(jobid)])
+        interval_after_poll()
+    assert executor.next_seconds_between_status_checks == 0.5
+    executor.shutdown()
+
+
+def test_executor_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    executor.finished_jobids.update({0, 1, 2})
+    executor.run_jobs(make_jobs(5))
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 3)
+    # a status check may have run before all jobs were submitted
+    wait_for(lambda: executor.metrics.active_jobs.get() == 2)
+    executor.metrics.exporters.append(PrometheusTextfileExporter("metrics.prom"))
+    executor.shutdown()
+
+    assert executor.metrics.submissions.get(rule="a") == 5
+    assert executor.metrics.successes.get(rule="a") == 3
+    assert executor.metrics.submit_seconds.count() == 5
+    assert executor.metrics.status_check_seconds.count() > 0
+    assert os.stat(tmp_path / "metrics.prom").st_mode & 0o777 == 0o644
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'snakemake_executor_job_submissions_total{rule="a"} 5' in text
+    assert "snakemake_executor_active_jobs 2" in text
+
+
+def test_concurrent_job_submission(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    jobs = make_jobs(400)
+    executor.finished_jobids.update(job.jobid for job in jobs)
+    # submit from several threads while the status checks drain the deque
+    threads = [
+        threading.Thread(target=executor.run_jobs, args=(jobs[i::4],)) for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler = executor.workflow.scheduler
+    wait_for(lambda: len(scheduler.finished) == len(jobs))
+    executor.shutdown()
+
+    assert sorted(job.jobid for job in scheduler.finished) == list(range(len(jobs)))
+    assert not executor.active_jobs
+    assert not executor._submitted_jobs
+    assert not executor.lock.locked()
+
+
+def test_async_lock_deprecated():
+    lock = threading.Lock()
+
+    async def use_lock():
+        async with async_lock(lock):
+            assert lock.locked()
+
+    with pytest.warns(DeprecationWarning):
+        asyncio.run(use_lock())
+    assert not lock.locked()
+
+
+def test_wait_for_files_file_shared(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    jobs = make_jobs(2, n_input=30)
+    for job in jobs:
+        job._input = jobs[0]._input
+    paths = {
+        executor.get_job_args(job).split("--wait-for-files-file ")[1].split()[0]
+        for job in jobs
+    }
+    assert len(paths) == 1
+    with open(paths.pop().strip("'")) as f:
+        assert f.read().splitlines() == [executor.tmpdir] + jobs[0]._input
+    executor.shutdown()
+
+
+def test_format_job_exec(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    exec_job = executor.format_job_exec(StubJob(3))
+    executor.shutdown()
+
+    # the command line must stay unchanged by optimizations of its formatting
+    assert exec_job == (
+        "export SNAKEMAKE_TEST_TOKEN='secret' && "
+        f"{sys.executable} -m snakemake "
+        f"--snakefile '{tmp_path / 'Snakefile'}' "
+        "--target-jobs 'a:sample=s3' --allowed-rules a --cores 'all' "
+        "--attempt 1 --force-use-threads  "
+        f"--wait-for-files '{executor.tmpdir}' 'data/a/3/0.txt' "
+        "--force --target-files-omit-workdir-adjustment "
+        "--keep-storage-local-copies --max-inventory-time 0 --nocolor --notemp "
+        "--no-hooks --nolock --ignore-incomplete "
+        "--rerun-triggers mtime params code software-env input "
+        "--conda-frontend conda --shared-fs-usage persistence input-output "
+        "software-deployment sources source-cache "
+        "--wrapper-prefix https://github.com/snakemake/snakemake-wrappers/raw/ "
+        "--latency-wait 5 --scheduler ilp "
+        "--local-storage-prefix .snakemake/storage "
+        "--scheduler-solver-path /usr/bin "
+        "--default-resources 'mem_mb=min(max(2*input.size_mb, 1000), 8000)' "
+        "'disk_mb=max(2*input.size_mb, 1000) if input else 50000' "
+        "'tmpdir=system_tmpdir' --mode 'remote'"
+    )
+
+
+def test_spill_job_args(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        max_inline_job_args_size=100,
+    )
+    executor = make_executor(common_settings=common_settings)
+    job = make_jobs(1, n_input=30)[0]
+    job_args = executor.get_job_args(job)
+    assert len(job_args) > 100
+    exec_job = executor.format_job_exec(job)
+    assert job_args not in exec_job
+    assert exec_job.startswith(". ")
+    assert ' "$@" ' in exec_job
+    path = exec_job.split()[1].strip("'")
+    with open(path) as f:
+        assert f.read() == f"set -- {job_args}\n"
+    # the args are parsed by the shell as if they were inline
+    echoed = subprocess.run(
+        ["sh", "-c", f'. {path} && printf "%s\\n" "$@"'],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.splitlines()
+    assert echoed == shlex.split(job_args)
+
+    # the spilled job command passes the same args as the inline one
+    def run_job_cmd(exec_job):
+        exec_job = exec_job.replace(f"{sys.executable} -m snakemake", 'printf "%s\\n"')
+        return subprocess.run(
+            ["sh", "-c", exec_job], capture_output=True, text=True, check=True
+        ).stdout
+
+    executor.common_settings.max_inline_job_args_size = None
+    inline_exec_job = executor.format_job_exec(job)
+    assert job_args in inline_exec_job
+    echoed = run_job_cmd(exec_job)
+    assert echoed == run_job_cmd(inline_exec_job)
+    assert "\n".join(shlex.split(job_args)) in echoed
+
+    # the size is measured in bytes
+    job = StubJob(1, rule="ä")
+    job_args = executor.get_job_args(job)
+    executor.common_settings.max_inline_job_args_size = len(job_args)
+    assert len(job_args.encode()) > len(job_args)
+    assert job_args not in executor.format_job_exec(job)
+    executor.shutdown()
+
+
+def test_envvar_declarations_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        envvar_declarations_file=True,
+    )
+    executor = make_executor(common_settings=common_settings)
+    exec_job = executor.format_job_exec(make_jobs(1)[0])
+    assert "secret" not in exec_job
+    assert exec_job.startswith(". ")
+    path = exec_job.split()[1].strip("'")
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    echoed = subprocess.run(
+        ["sh", "-c", f'. {path} && sh -c "echo \\$SNAKEMAKE_TEST_TOKEN"'],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert echoed == "secret\n"
+    # the file is written once per run and not named by its content
+    executor.invalidate_job_exec_context()
+    assert executor.format_job_exec(make_jobs(1)[0]) == exec_job
+    content = Path(path).read_bytes()
+    assert hashlib.sha256(content).hexdigest() not in path
+    executor.shutdown()
+    executor = make_executor(common_settings=common_settings)
+    assert executor.format_job_exec(make_jobs(1)[0]) != exec_job
+    executor.shutdown()
+
+
+def test_job_bundles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        max_job_bundle_size=3,
+        max_bundled_job_runtime=180,
+    )
+    executor = make_executor(common_settings=common_settings)
+    jobs = make_jobs(5) + make_jobs(1, resources={"mem_mb": 2000, "runtime": 5})
+    jobs[-1]._jobid = 5
+    bundles = bundle_jobs(jobs, 3, 180)
+    assert [len(b) if isinstance(b, JobBundle) else 1 for b in bundles] == [3, 2, 1]
+    assert bundles[0].resources["runtime"] == 180
+    # the jobs of a bundle run one after another
+    exec_bundle = executor.format_job_exec(bundles[0])
+    for job in bundles[0]:
+        assert executor.format_job_exec(job) in exec_bundle
+
+    scheduler = executor.workflow.scheduler
+    executor.run_jobs(jobs)
+    assert scheduler.submitted == jobs
+    # bundles are checked as a single job
+    executor.finished_jobids.update({0, 3, 5})
+    wait_for(lambda: len(scheduler.finished) == 6)
+    executor.shutdown()
+
+
+def test_job_bundles_runtime_cutoff():
+    # long jobs are not bundled
+    jobs = make_jobs(4, resources={"runtime": 1440})
+    assert bundle_jobs(jobs, 4, 60) == jobs
+    # neither are jobs without a numeric runtime
+    jobs = make_jobs(2, resources={"runtime": None}) + make_jobs(
+        2, resources={"mem_mb": 1000}
+    )
+    assert bundle_jobs(jobs, 4, 60) == jobs
+    # the summed runtime of a bundle does not exceed the cutoff
+    bundles = bundle_jobs(make_jobs(4, resources={"runtime": 20}), 4, 60)
+    assert [len(b) if isinstance(b, JobBundle) else 1 for b in bundles] == [3, 1]
+    assert bundles[0].resources["runtime"] == 60
+
+
+def test_job_bundle_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    jobs = make_jobs(4)
+    bundle = JobBundle(jobs)
+    # job 1 fails, job 3 is killed before it exits
+    exec_bundle = executor.format_job_exec(bundle).replace(
+        f"{sys.executable} -m snakemake", "run_job"
+    )
+    status = subprocess.run(
+        [
+            "sh",
+            "-c",
+            'run_job() { case "$*" in *s1*) return 3;; *s3*) exit 9;; esac; }; '
+            + exec_bundle,
+        ]
+    ).returncode
+    assert status == 9
+    # the output of a killed job does not count as success
+    for f in jobs[3].output:
+        os.makedirs(os.path.dirname(f))
+        open(f, "w").close()
+    executor.report_job_error(SubmittedJobInfo(bundle, external_jobid="1"))
+    assert executor.workflow.scheduler.finished == [jobs[0], jobs[2]]
+    assert executor.workflow.scheduler.failed == [jobs[1], jobs[3]]
+    executor.shutdown()
+
+
+def test_job_bundle_exit_status(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    exec_bundle = executor.format_job_exec(JobBundle(make_jobs(3))).replace(
+        f"{sys.executable} -m snakemake", "run_job"
+    )
+
+    def run_bundle(failing):
+        return subprocess.run(
+            [
+                "sh",
+                "-c",
+                f'run_job() {{ case "$*" in {failing}) return 3;; esac; }}; '
+                + exec_bundle,
+            ]
+        ).returncode
+
+    assert run_bundle("*s1*") == 3
+    assert run_bundle("_") == 0
+    executor.shutdown()
+
+
+class HangingCancelExecutor(StubRemoteExecutor):
+    def cancel_jobs(self, active_jobs):
+        if any(job_info.job.jobid == 0 for job_info in active_jobs):
+            time.sleep(5)
+        super().cancel_jobs(active_jobs)
+
+
+def test_cancel_in_chunks_with_timeout(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        cancel_chunk_size=3,
+        max_concurrent_cancels=2,
+        cancel_timeout=0.5,
+    )
+    executor = make_executor(HangingCancelExecutor, common_settings=common_settings)
+    executor.run_jobs(make_jobs(10))
+    start = time.time()
+    executor.cancel()
+    assert time.time() - start < 2
+    assert sorted(job_info.job.jobid for job_info in executor.cancelled) == list(
+        range(3, 10)
+    )
+    assert (
+        "Cancellation of 3 jobs could not be confirmed. "
+        "Please check and cancel them manually if necessary: 0, 1, 2"
+        in executor.logger.messages
+    )
+
+
+class BlockingStatusExecutor(StubRemoteExecutor):
+    cancel_snapshot_timeout = 0.1
+
+    def __init__(self, *args, **kwargs):
+        # before the status checks start
+        self.in_check = threading.Event()
+        self.release = threading.Event()
+        self.block_loop = False
+        super().__init__(*args, **kwargs)
+
+    async def check_active_jobs(self, active_jobs):
+        self.in_check.set()
+        if self.block_loop:
+            # a plugin that blocks the event loop
+            self.release.wait(5)
+        else:
+            while not self.release.is_set():
+                await asyncio.sleep(0.01)
+        for job_info in active_jobs:
+            yield job_info
+
+
+@pytest.mark.parametrize("block_loop", [False, True])
+def test_cancel_jobs_in_check(tmp_path, monkeypatch, block_loop):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(BlockingStatusExecutor)
+    executor.block_loop = block_loop
+    executor.run_jobs(make_jobs(2))
+    assert executor.in_check.wait(5)
+    # jobs 0 and 1 are under check, jobs 2 and 3 wait in the handoff deque
+    executor.run_jobs([StubJob(2), StubJob(3)])
+    # the check has to end for the shutdown at the end of cancel()
+    threading.Timer(0.5, executor.release.set).start()
+    executor.cancel()
+    assert sorted(job_info.job.jobid for job_info in executor.cancelled) == [
+        0,
+        1,
+        2,
+        3,
+    ]
+
+
+def test_async_command_runner(tmp_path):
+    runner = AsyncCommandRunner(max_concurrent=2)
+    counter = tmp_path / "counter"
+
+    async def run():
+        cmd = f"echo x >> {counter}; sleep 0.2; echo done"
+        # identical commands are run each
+        results = await asyncio.gather(runner.run(cmd), runner.run(cmd))
+        assert results == ["done\n", "done\n"]
+        assert counter.read_text() == "x\nx\n"
+        # unless they are marked as reusable while in flight
+        results = await asyncio.gather(
+            runner.run(cmd, reuse_in_flight=True), runner.run(cmd, reuse_in_flight=True)
+        )
+        assert results == ["done\n", "done\n"]
+        assert counter.read_text() == "x\nx\nx\n"
+
+        lines = [line async for line in runner.iter_lines(["printf", "a\\nb\\n"])]
+        assert lines == ["a", "b"]
+
+        with pytest.raises(CommandError) as e:
+            await runner.run("echo error >&2; exit 3")
+        assert e.value.returncode == 3
+        assert e.value.stderr == "error\n"
+
+        with pytest.raises(CommandError, match="timed out"):
+            await runner.run(["sleep", "5"], timeout=0.1)
+        with pytest.raises(CommandError, match="timed out"):
+            async for _ in runner.iter_lines(["sleep", "5"], timeout=0.1):
+                pass
+
+    asyncio.run(run())
+
+
+def test_active_job_store(tmp_path, monkeypatch):
+    job_infos = [
+        SubmittedJobInfo(job, external_jobid=f"ext{job.jobid}") for job in make_jobs(3)
+    ]
+    store = ActiveJobStore(job_infos)
+    assert len(store) == 3
+    assert store.get_by_external_jobid("ext1") is job_infos[1]
+    assert store.get_by_jobid(2) is job_infos[2]
+    snapshot = store.as_list()
+    assert store.as_list() is snapshot
+    assert store.discard(job_infos[1])
+    assert not store.discard(job_infos[1])
+    assert job_infos[1] not in store
+    assert store.get_by_external_jobid("ext1") is None
+    assert list(store) == [job_infos[0], job_infos[2]]
+    assert set(store.external_jobids()) == {"ext0", "ext2"}
+
+    # the executor keeps the store in sync with its active jobs
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor()
+    executor.run_jobs(make_jobs(5))
+    wait_for(lambda: len(executor.active_job_store) == 5)
+    assert executor.active_job_store.get_by_external_jobid("3").job.jobid == 3
+    executor.finished_jobids.update({1, 3})
+    wait_for(lambda: len(executor.active_job_store) == 3)
+    assert executor.active_job_store.get_by_external_jobid("3") is None
+    executor.shutdown()
+
+
+def test_submission_journal_reattach(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        submission_journal=True,
+    )
+    executor = make_executor(common_settings=common_settings)
+    executor.run_jobs(make_jobs(3))
+    executor.finished_jobids.add(0)
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 1)
+    # simulate a crash of the main process, leaving jobs 1 and 2 running
+    executor.wait = False
+    executor.wait_future.result()
+    executor.submission_journal.close()
+
+    executor = make_executor(common_settings=common_settings)
+    assert len(executor.submission_journal.running) == 2
+    jobs = make_jobs(4)
+    executor.run_jobs(jobs)
+    # jobs 1 and 2 are reattached, jobs 0 and 3 are submitted
+    scheduler = executor.workflow.scheduler
+    assert scheduler.submitted == [jobs[1], jobs[2], jobs[0], jobs[3]]
+    assert not executor.submission_journal.running
+    executor.finished_jobids.update(range(4))
+    wait_for(lambda: len(scheduler.finished) == 4)
+    executor.shutdown()
+
+    executor = make_executor(common_settings=common_settings)
+    assert not executor.submission_journal.running
+    executor.shutdown()
+
+
+class NoOutputJob(StubJob):
+    @property
+    def output(self):
+        return []
+
+
+def test_submission_journal_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # jobs without output are told apart by rule, wildcards and jobid
+    digests = {
+        job_output_digest(job)
+        for job in [NoOutputJob(1), NoOutputJob(2), NoOutputJob(1, rule="b")]
+    }
+    assert len(digests) == 3
+    assert job_output_digest(StubJob(1)) != job_output_digest(StubJob(1, rule="b"))
+
+    journal = SubmissionJournal(str(tmp_path / "journal.jsonl"))
+    journal.submitted(SubmittedJobInfo(StubJob(1), external_jobid="1", aux={"a": 1}))
+    # records are written out immediately, while the journal stays open
+    assert '"external_jobid": "1"' in (tmp_path / "journal.jsonl").read_text()
+    with pytest.raises(WorkflowError, match="JSON serializable"):
+        journal.submitted(
+            SubmittedJobInfo(StubJob(2), external_jobid="2", aux={"a": object()})
+        )
+    journal.close()
+    journal = SubmissionJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.pop_running(StubJob(1))["aux"] == {"a": 1}
+    assert journal.pop_running(StubJob(2)) is None
+    journal.close()
+
+
+class AsyncSubmitExecutor(StubRemoteExecutor):
+    async def run_job(self, job):
+        # finish in reverse order
+        await asyncio.sleep(0.01 * (10 - job.jobid))
+        self.report_job_submission(
+            SubmittedJobInfo(job, external_jobid=str(job.jobid)),
+            register_job=False,
+        )
+
+
+def test_async_run_job(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(AsyncSubmitExecutor)
+    jobs = make_jobs(10)
+    start = time.time()
+    executor.run_jobs(jobs)
+    # submitted concurrently, reported in order
+    assert time.time() - start < 0.5
+    assert executor.workflow.scheduler.submitted == jobs
+    executor.finished_jobids.update(range(10))
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 10)
+    executor.shutdown()
+
+
+def test_async_run_job_overlapping_calls(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(AsyncSubmitExecutor)
+    jobs = make_jobs(10)
+    for job in jobs[5:]:
+        job._jobid += 10
+    # each call passes on the submissions of its own jobs
+    threads = [
+        threading.Thread(target=executor.run_jobs, args=(jobs[:5],)),
+        threading.Thread(target=executor.run_jobs, args=(jobs[5:],)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    submitted = executor.workflow.scheduler.submitted
+    assert sorted(submitted, key=lambda job: job.jobid) == jobs
+    assert [job for job in submitted if job in jobs[:5]] == jobs[:5]
+    executor.finished_jobids.update(job.jobid for job in jobs)
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 10)
+    executor.shutdown()
+
+
+class BatchKeyExecutor(StubRemoteExecutor):
+    """Returns a batch key by job parity, but submits via run_job only."""
+
+    def get_job_batch_key(self, job):
+        return job.jobid % 2
+
+
+class BatchExecutor(BatchKeyExecutor):
+    """Submits batches as a whole, returning the submitted jobs in reverse
+    order. Jobs in missing_jobids are left out.
+    """
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.batches = []
+        self.missing_jobids = set()
+
+    def run_job_batch(self, jobs):
+        self.batches.append([job.jobid for job in jobs])
+        return [
+            SubmittedJobInfo(job, external_jobid=f"array.{job.jobid}")
+            for job in reversed(jobs)
+            if job.jobid not in self.missing_jobids
+        ]
+
+
+def test_run_job_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(BatchExecutor)
+    assert executor.supports_job_batches
+    jobs = make_jobs(5)
+    executor.run_jobs(jobs)
+    assert executor.batches == [[0, 2, 4], [1, 3]]
+    # reported in the order of the batch, matched by job
+    submitted = executor.workflow.scheduler.submitted
+    assert [job.jobid for job in submitted] == [0, 2, 4, 1, 3]
+    assert [job.external_jobid for job in submitted] == [
+        f"array.{job.jobid}" for job in submitted
+    ]
+
+    executor.missing_jobids.add(7)
+    with pytest.raises(WorkflowError, match="one submitted job per job"):
+        executor.run_jobs(make_jobs(10)[5:])
+    executor.shutdown()
+
+
+def test_run_job_batch_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(BatchKeyExecutor)
+    # the batch key is ignored without run_job_batch
+    assert not executor.supports_job_batches
+    jobs = make_jobs(3)
+    executor.run_jobs(jobs)
+    assert executor.workflow.scheduler.submitted == jobs
+    # the default submits the jobs via run_job
+    assert executor.run_job_batch(make_jobs(5)[3:]) == []
+    assert [job.jobid for job in executor.workflow.scheduler.submitted] == [
+        0,
+        1,
+        2,
+        3,
+        4,
+    ]
+    executor.shutdown()
+
+
+class FlakyStatusExecutor(StubRemoteExecutor):
+    async def check_active_jobs(self, active_jobs):
+        if not getattr(self, "failed_once", False):
+            self.failed_once = True
+            raise IOError("scheduler unavailable")
+        async for job_info in super().check_active_jobs(active_jobs):
+            yield job_info
+
+
+def test_status_check_error_isolation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(FlakyStatusExecutor)
+    executor.finished_jobids.update(range(3))
+    executor.run_jobs(make_jobs(3))
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 3)
+    assert not executor.workflow.scheduler.errors
+    assert any("will retry" in msg for msg in executor.logger.messages)
+    executor.shutdown()
+
+
+class FailingStatusExecutor(StubRemoteExecutor):
+    async def check_active_jobs(self, active_jobs):
+        self.n_checks = getattr(self, "n_checks", 0) + 1
+        raise WorkflowError("invalid status query")
+        yield
+
+
+def test_status_check_fatal_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    executor = make_executor(FailingStatusExecutor)
+    executor.run_jobs(make_jobs(1))
+    # a WorkflowError is not retried
+    executor.wait_thread.join(timeout=5)
+    assert not executor.wait_thread.is_alive()
+    wait_for(lambda: executor.workflow.scheduler.errors)
+    (error,) = executor.workflow.scheduler.errors
+    assert str(error) == "invalid status query"
+    assert executor.n_checks == 1
+    assert executor.logger.messages[-1] == (
+        "Error checking the status of active jobs: invalid status query"
+    )
+    executor.shutdown()
+
+
+class CountingStatusExecutor(StubRemoteExecutor):
+    async def check_active_jobs(self, active_jobs):
+        self.checked = [job_info.job.jobid for job_info in active_jobs]
+        for job_info in active_jobs:
+            self.report_job_status(job_info, "RUNNING")
+            yield job_info
+
+
+def test_tiered_status_checks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        max_status_check_staleness=60,
+    )
+    executor = make_executor(CountingStatusExecutor, common_settings=common_settings)
+    # poll manually instead of in the background
+    executor.wait = False
+    executor.wait_future.result()
+    executor.run_jobs(make_jobs(2))
+
+    def poll():
+        executor.checked = []
+        asyncio.run(executor._poll_active_jobs())
+        return sorted(executor.checked)
+
+    assert poll() == [0, 1]
+    # job 0 has been running unchanged for an hour, job 1 is young
+    job_info = executor.active_job_store.get_by_jobid(0)
+    old_state = executor._job_poll_states[id(job_info)]
+    old_state.changed -= 3600
+    assert poll() == [1]
+    assert len(executor.active_jobs) == 2
+    # job 0 is checked again before exceeding the maximum staleness
+    old_state.checked -= 60
+    assert poll() == [0, 1]
+    assert poll() == [1]
+    # a state change makes job 0 young again
+    executor.report_job_status(job_info, "COMPLETING")
+    assert poll() == [0, 1]
+    executor.shutdown()
+
+
+def test_tiered_adaptive_status_checks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    common_settings = make_common_settings(
+        adaptive_status_checks=True,
+        min_seconds_between_status_checks=0.5,
+        max_seconds_between_status_checks=4,
+        max_status_check_staleness=3,
+        # no status check before stop_status_checks
+        init_seconds_before_status_checks=60,
+    )
+    executor = make_executor(
+        CountingStatusExecutor,
+        common_settings=common_settings,
+        seconds_between_status_checks=0.75,
+    )
+    stop_status_checks(executor)
+    executor.run_jobs(make_jobs(3))
+    poll_once(executor)
+    assert executor.next_seconds_between_status_checks == 0.5
+    # job 0 has been running unchanged for an hour
+    old_state = executor._job_poll_states[id(executor.active_job_store.get_by_jobid(0))]
+    old_state.changed -= 3600
+    checked = []
+    intervals = []
+    for _ in range(4):
+        poll_once(executor)
+        checked.append(sorted(executor.checked))
+        intervals.append(executor.next_seconds_between_status_checks)
+    # the varying set of checked jobs does not keep the interval down
+    assert checked[0] == [1, 2]
+    assert intervals == [0.75, 1.125, 1.6875, 2.53125]
+    # the interval stays below the maximum staleness
+    for _ in range(3):
+        poll_once(executor)
+    assert executor.next_seconds_between_status_checks == 3
+    executor.shutdown()
+
+
+def test_source_archive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("workflow/scripts")
+    Path("workflow/Snakefile").write_text("rule a:\n    output: 'a'\n")
+    Path("workflow/scripts/a.py").write_text("print('a')\n")
+    sources = ["workflow/Snakefile", "workflow/scripts/a.py"]
+    shared_fs_usage = set(SharedFSUsage.all()) - {SharedFSUsage.SOURCES}
+
+    def get_source_archive():
+        executor = make_executor(shared_fs_usage=shared_fs_usage)
+        executor.workflow.dag.sources = sources
+        archive = executor.get_source_archive()
+        executor.shutdown()
+        return executor, archive
+
+    _, archive = get_source_archive()
+    built = os.stat(archive.path).st_ino
+    # the next run reuses the archive
+    _, archive2 = get_source_archive()
+    assert archive2 == archive
+    assert os.stat(archive.path).st_ino == built
+    # a changed source leads to a new archive
+    Path("workflow/scripts/a.py").write_text("print('b')\n")
+    _, archive3 = get_source_archive()
+    assert archive3.digest != archive.digest
+
+    os.makedirs("job")
+    cmd = format_source_archive_extract_cmd(archive3.path, archive3.digest)
+    for _ in range(2):
+        subprocess.run(cmd, shell=True, check=True, cwd="job")
+    assert Path("job/workflow/scripts/a.py").read_text() == "print('b')\n"
+
+    executor = make_executor()
+    assert executor.get_source_archive() is None
+    executor.shutdown()
+
+
+@pytest.mark.parametrize("source", ["../Snakefile", "/tmp/Snakefile", "a/../../b"])
+def test_source_archive_outside_workdir(tmp_path, monkeypatch, source):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(WorkflowError, match="outside of the working directory"):
+        build_source_archive([source], "source-archives")
+
+
+class StateReportingExecutor(StubRemoteExecutor):
+    async def check_active_jobs(self, active_jobs):
+        for job_info in active_jobs:
+            self.report_job_status(job_info, "RUNNING")
+        async for job_info in super().check_active_jobs(active_jobs):
+            yield job_info
+
+
+@pytest.mark.parametrize("trace_file", ["trace.json", "trace.otlp.json"])
+def test_job_tracing(tmp_path, monkeypatch, trace_file):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(trace_file_envvar, trace_file)
+    executor = make_executor(StateReportingExecutor)
+    executor.run_jobs(make_jobs(2))
+    wait_for(lambda: executor.metrics.active_jobs.get() == 2)
+    executor.finished_jobids.add(0)
+    wait_for(lambda: len(executor.workflow.scheduler.finished) == 1)
+    executor.shutdown()
+
+    with open(trace_file) as f:
+        trace = json.load(f)
+    if trace_file == "trace.json":
+        spans = [
+            (event["name"], event["args"].get("jobid"))
+            for event in trace["traceEvents"]
+            if event["ph"] == "X"
+        ]
+    else:
+        spans = [
+            (
+                span["name"],
+                {
+                    attr["key"]: int(attr["value"]["intValue"])
+                    for attr in span["attributes"]
+                    if attr["key"] == "jobid"
+                }.get("jobid"),
+            )
+            for span in trace["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        ]
+    for jobid in (0, 1):
+        for name in ("build command", "submit", "submitted", "RUNNING"):
+            assert (name, jobid) in spans
+    assert ("status check", None) in spans
+
+
+def test_event_loop_service():
+    service = get_event_loop_service()
+    errors = []
+
+    async def fail():
+        raise ValueError("error")
+
+    async def add(a, b):
+        await asyncio.sleep(0.01)
+        return a + b
+
+    service.spawn(fail(), on_error=errors.append)
+    assert service.run(add(1, 2)) == 3
+    wait_for(lambda: len(errors) == 1)
+    assert isinstance(errors[0], ValueError)
+    assert service.is_running()